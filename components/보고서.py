@@ -1,120 +1,87 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from utils.data_manager import DataManager
+from utils.app_data import get_data_manager
+from utils.reports import yearly_comparison
+from utils.fx import BASE_CURRENCY, format_amount
 from utils.visualizations import (
+    amount_axis_title,
     create_monthly_summary_chart,
     create_revenue_trend_chart,
     create_cost_trend_chart,
     create_cumulative_balance_chart,
-    create_year_over_year_comparison_chart
+    create_cumulative_subcategory_chart,
+    create_year_over_year_comparison_chart,
+    year_color_map
 )
-from datetime import datetime
-import json
-
-# Load the secret and initialize DataManager
-try:
-    secret_file = st.secrets["accounting_data"]["data"]
-    accounting_data = json.loads(secret_file)  # Parse the JSON string
-    data_manager = DataManager(accounting_data)
-except KeyError:
-    st.error("Unable to load accounting data. Please check the Streamlit secrets configuration.")
-    st.stop()
+
 
 def reports_page():
+    # Shared with the other pages (see utils.app_data)
+    data_manager = get_data_manager()
     st.title("예산 보고서")
     
-    current_year = datetime.now().year
-    last_year = current_year - 1
-
-    # Fetch data for the current and last years
-    revenues_current = data_manager.get_revenues(current_year)
-    costs_current = data_manager.get_costs(current_year)
-    revenues_last = data_manager.get_revenues(last_year)
-    costs_last = data_manager.get_costs(last_year)
-    
-    # Convert revenue and cost data to DataFrames for current year
-    df_revenue_current = pd.DataFrame(revenues_current)
-    if not df_revenue_current.empty:
-        df_revenue_current['date'] = pd.to_datetime(df_revenue_current['date'], errors='coerce')
-        df_revenue_current['type'] = '수입'
-        df_revenue_current['year'] = current_year
-
-    df_costs_current = pd.DataFrame()
-    for event, subcategories in costs_current.items():
-        for subcategory, subcategory_costs in subcategories.items():
-            df_category = pd.DataFrame(subcategory_costs)
-            df_category['event'] = event
-            df_category['subcategory'] = subcategory
-            df_costs_current = pd.concat([df_costs_current, df_category], ignore_index=True)
-
-    if not df_costs_current.empty:
-        df_costs_current['date'] = pd.to_datetime(df_costs_current['date'], errors='coerce')
-        df_costs_current['type'] = '지출'
-        df_costs_current['year'] = current_year
-
-    # Convert revenue and cost data to DataFrames for last year
-    df_revenue_last = pd.DataFrame(revenues_last)
-    if not df_revenue_last.empty:
-        df_revenue_last['date'] = pd.to_datetime(df_revenue_last['date'], errors='coerce')
-        df_revenue_last['type'] = '수입'
-        df_revenue_last['year'] = last_year
-
-    df_costs_last = pd.DataFrame()
-    for event, subcategories in costs_last.items():
-        for subcategory, subcategory_costs in subcategories.items():
-            df_category = pd.DataFrame(subcategory_costs)
-            df_category['event'] = event
-            df_category['subcategory'] = subcategory
-            df_costs_last = pd.concat([df_costs_last, df_category], ignore_index=True)
-
-    if not df_costs_last.empty:
-        df_costs_last['date'] = pd.to_datetime(df_costs_last['date'], errors='coerce')
-        df_costs_last['type'] = '지출'
-        df_costs_last['year'] = last_year
-
-    # Combine all data for filtering and reports
-    df_combined = pd.concat([df_revenue_current, df_costs_current, df_revenue_last, df_costs_last])
-    
-    if df_combined.empty:
+    # Years to compare come from the ledger itself, defaulting to the two most recent ones
+    available_years = data_manager.get_years()
+    report_years = sorted(st.multiselect("비교 연도 선택", available_years, default=available_years[-2:], key="report_years"))
+    
+    if not report_years:
+        st.warning("No data available for the selected period.")
+        return
+
+    current_year = report_years[-1]
+    last_year = report_years[-2] if len(report_years) > 1 else None
+
+    # Transactions of the selected years, already in date order from the date index
+    transactions = data_manager.get_transactions(f"{report_years[0]}-01-01", f"{current_year}-12-31", years=report_years)
+    
+    if not transactions:
         st.warning("No data available for the selected period.")
         return
 
-    df_combined = df_combined.sort_values('date')
+    first_date = pd.Timestamp(transactions[0].entry['date'])
+    last_date = pd.Timestamp(transactions[-1].entry['date'])
 
     # Date range filter
-    start_date = st.date_input("Start Date", min(df_combined['date'].min(), pd.Timestamp.today()))
-    end_date = st.date_input("End Date", max(df_combined['date'].max(), pd.Timestamp.today()))
+    start_date = st.date_input("Start Date", min(first_date, pd.Timestamp.today()))
+    end_date = st.date_input("End Date", max(last_date, pd.Timestamp.today()))
     
-    df_filtered = df_combined[(df_combined['date'] >= pd.Timestamp(start_date)) & 
-                              (df_combined['date'] <= pd.Timestamp(end_date))]
+    # Amounts converted to the reporting currency, cached per ledger version and currency
+    currency = st.session_state.get("reporting_currency", BASE_CURRENCY)
+    df_filtered = data_manager.get_transaction_frame(currency, start_date, end_date, years=report_years)
     
     if df_filtered.empty:
         st.warning("No data found for the selected date range.")
         return
 
-    # Summary statistics
-    total_revenue_current = df_filtered[(df_filtered['type'] == '수입') & (df_filtered['year'] == current_year)]['amount'].sum()
-    total_costs_current = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'] == current_year)]['amount'].sum()
-    net_balance_current = total_revenue_current - total_costs_current
-    
-    total_revenue_last = df_filtered[(df_filtered['type'] == '수입') & (df_filtered['year'] == last_year)]['amount'].sum()
-    total_costs_last = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'] == last_year)]['amount'].sum()
-    net_balance_last = total_revenue_last - total_costs_last
+    # Summary statistics for every selected year in one grouped pass
+    yearly_summary = yearly_comparison(df_filtered, report_years)
+    current = yearly_summary.loc[current_year]
+    previous = yearly_summary.loc[last_year] if last_year is not None else current * 0
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("총 수입", f"${total_revenue_current:,.2f}", f"${total_revenue_current - total_revenue_last:,.2f}")
-    col2.metric("총 지출", f"${total_costs_current:,.2f}", f"${total_costs_current - total_costs_last:,.2f}")
-    col3.metric("총 잔액", f"${net_balance_current:,.2f}", f"${net_balance_current - net_balance_last:,.2f}")
+    col1.metric("총 수입", format_amount(current['수입'], currency), format_amount(current['수입'] - previous['수입'], currency))
+    col2.metric("총 지출", format_amount(current['지출'], currency), format_amount(current['지출'] - previous['지출'], currency))
+    col3.metric("총 잔액", format_amount(current['잔액'], currency), format_amount(current['잔액'] - previous['잔액'], currency))
+    if len(report_years) > 2:
+        st.dataframe(yearly_summary)
 
     # Year-over-Year Comparison
     st.subheader("연간 비교")
-    yearly_totals = df_filtered.groupby(['year', 'event'])['amount'].sum().reset_index()
-    color_map = {2023: '#1f77b4', 2024: '#ff7f0e'}
+    # Event totals per year are a roll-up of the cost cube of the selected window, so they match the metrics above
+    cost_cube = data_manager.get_window_cube(currency, start_date, end_date, years=report_years).slice(
+        type='지출', year=report_years)
+    yearly_totals = pd.DataFrame([
+        {'year': year, 'event': event, 'amount': amount}
+        for (year, event), amount in cost_cube.roll_up('year', 'event').items()
+    ], columns=['year', 'event', 'amount'])
+    # Years as strings so plotly treats them as categories rather than a continuous scale
+    yearly_totals['year'] = yearly_totals['year'].astype(str)
+    color_map = year_color_map(report_years)
     
     yoy_chart = px.bar(yearly_totals, x='event', y='amount', color='year',
                        title='Year-over-Year Comparison',
-                       labels={'amount': '금액', 'event': '이벤트', 'year': '연도'},
+                       labels={'amount': amount_axis_title(currency, '금액'), 'event': '이벤트', 'year': '연도'},
                        barmode='group',
                        color_discrete_map=color_map)
     
@@ -129,7 +96,7 @@ def reports_page():
         yoy_chart.add_annotation(
             x=row['event'],
             y=row['amount'],
-            text=f"${row['amount']:,.2f}",
+            text=format_amount(row['amount'], currency),
             showarrow=False,
             yshift=10,
             font=dict(size=9),
@@ -164,24 +131,18 @@ def reports_page():
     # Create chart
     fig = px.bar(monthly_summary_melted, x='date', y='amount', color='subcategory',
                  title='Monthly Summary by Subcategory',
-                 labels={'date': '월', 'amount': '금액', 'subcategory': '하위 카테고리'})
+                 labels={'date': '월', 'amount': amount_axis_title(currency, '금액'), 'subcategory': '하위 카테고리'})
     
     fig.update_layout(barmode='stack', xaxis_tickformat='%Y-%m')
     st.plotly_chart(fig, use_container_width=True)
 
     # Cumulative Expenses by Subcategories
     st.subheader("누적 지출 (하위 카테고리별)")
-    selected_years = st.multiselect("연도 선택", [2023, 2024], default=[2023, 2024])
+    selected_years = st.multiselect("연도 선택", report_years, default=report_years)
     df_expenses = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'].isin(selected_years))]
 
     if not df_expenses.empty:
-        df_expenses = df_expenses.sort_values('date')
-        df_cumulative = df_expenses.groupby(['date', 'subcategory'])['amount'].sum().unstack(fill_value=0).cumsum()
-
-        fig_cumulative = px.line(df_cumulative, x=df_cumulative.index, y=df_cumulative.columns,
-                                 title='Cumulative Expenses by Subcategory',
-                                 labels={'value': '누적 금액', 'date': '날짜', 'variable': '하위 카테고리'})
-        fig_cumulative.update_layout(legend_title_text='하위 카테고리')
+        fig_cumulative = create_cumulative_subcategory_chart(df_expenses)
         st.plotly_chart(fig_cumulative, use_container_width=True)
     else:
         st.write("선택한 기간에 대한 지출 데이터가 없습니다.")
@@ -211,15 +172,49 @@ def reports_page():
         df_display = df_display[df_display['event'] == selected_event]
     if selected_subcategory != "All Subcategories":
         df_display = df_display[df_display['subcategory'] == selected_subcategory]
-    df_display = df_display[(df_display['date'] >= pd.Timestamp(start_date)) & (df_display['date'] <= pd.Timestamp(end_date))]
+    # Rows are still in date order, so the date window is two binary searches
+    lo = df_display['date'].searchsorted(pd.Timestamp(start_date), side='left')
+    hi = df_display['date'].searchsorted(pd.Timestamp(end_date), side='right')
+    df_display = df_display.iloc[lo:hi]
 
     columns_to_display = ['date', 'year', 'type', 'event', 'subcategory', 'description', 'amount']
     st.dataframe(df_display[columns_to_display])
 
     # Show total amount
     total_amount = df_display['amount'].sum()
-    st.write(f"총액: ₩{total_amount:,.0f}")
+    st.write(f"총액: {format_amount(total_amount, currency, decimals=0)}")
     
+    # Search transactions by description
+    st.subheader("거래 검색")
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        search_query = st.text_input("설명 검색", key="transaction_search")
+    with col2:
+        min_amount = st.number_input("최소 금액", min_value=0.0, value=0.0, step=1.0, key="search_min_amount")
+    with col3:
+        max_amount = st.number_input("최대 금액", min_value=0.0, value=0.0, step=1.0, key="search_max_amount")
+
+    if search_query:
+        hits = data_manager.search_transactions(search_query,
+                                                min_amount=min_amount or None,
+                                                max_amount=max_amount or None,
+                                                start_date=start_date, end_date=end_date)
+        if hits:
+            df_hits = pd.DataFrame([{
+                'date': hit.transaction.entry.get('date'),
+                'year': hit.transaction.year,
+                'type': hit.transaction.type,
+                'event': hit.transaction.event,
+                'subcategory': hit.transaction.subcategory,
+                'description': hit.transaction.entry.get('description'),
+                'amount': hit.transaction.entry.get('amount'),
+                'currency': hit.transaction.entry.get('currency') or BASE_CURRENCY,
+                'score': hit.score,
+            } for hit in hits])
+            st.dataframe(df_hits)
+        else:
+            st.write("검색 결과가 없습니다.")
+
     # Export to CSV
     if st.button("데이터를 CSV로 내보내기"):
         csv = df_filtered.to_csv(index=False)
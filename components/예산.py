@@ -1,15 +1,13 @@
 import streamlit as st
 import pandas as pd
-from utils.data_manager import DataManager
-import json
+from utils.app_data import get_data_manager
+from utils.fx import available_currencies, format_amount
+from utils.recurrence import FREQUENCIES, FREQUENCY_LABELS
 
-# Fetch the data from Streamlit secrets
-data = json.loads(st.secrets["accounting_data"]["data"])
-
-# Initialize the DataManager with the fetched data
-data_manager = DataManager(data)
 
 def revenue_page():
+    # Shared with the other pages (see utils.app_data)
+    data_manager = get_data_manager()
     st.title("예산 관리")
     
     revenues = data_manager.get_revenues()
@@ -20,18 +18,70 @@ def revenue_page():
         date = st.date_input("날짜")
         description = st.text_input("설명")
         amount = st.number_input("금액", min_value=0.01, step=0.01)
+        currency = st.selectbox("통화", available_currencies(data_manager.fx_rates))
         submitted = st.form_submit_button("예산 추가")
         
         if submitted:
             new_revenue = {
                 "date": date.isoformat(),
                 "description": description,
-                "amount": amount
+                "amount": amount,
+                "currency": currency
             }
-            data_manager.add_revenue(new_revenue)
-            st.success("예산 추가 성공!")
-            st.rerun()
+            try:
+                data_manager.add_revenue(new_revenue)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success("예산 추가 성공!")
+                st.rerun()
     
+    # Recurring revenues
+    st.subheader("반복 예산")
+    with st.form(key="add_recurring_revenue_form"):
+        recurring_description = st.text_input("설명", key="recurring_revenue_description")
+        recurring_amount = st.number_input("금액", min_value=0.01, step=0.01, key="recurring_revenue_amount")
+        recurring_currency = st.selectbox("통화", available_currencies(data_manager.fx_rates), key="recurring_revenue_currency")
+        frequency = st.selectbox("반복 주기", FREQUENCIES, format_func=FREQUENCY_LABELS.get, key="recurring_revenue_frequency")
+        interval = st.number_input("간격 (월/주/일)", min_value=1, step=1, value=1, key="recurring_revenue_interval")
+        recurring_start = st.date_input("시작 날짜", key="recurring_revenue_start")
+        recurring_end = st.date_input("종료 날짜", value=None, key="recurring_revenue_end")
+        recurring_submitted = st.form_submit_button(label="반복 예산 추가")
+
+    if recurring_submitted:
+        try:
+            data_manager.add_recurring({
+                "type": "수입",
+                "description": recurring_description,
+                "amount": recurring_amount,
+                "currency": recurring_currency,
+                "frequency": frequency,
+                "interval": int(interval),
+                "start": recurring_start.isoformat(),
+                "end": recurring_end.isoformat() if recurring_end else None,
+            })
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success("반복 예산 추가 성공!")
+            st.rerun()
+
+    for rule in data_manager.get_recurring():
+        if rule.get("type") != "수입":
+            continue
+        col1, col2, col3, col4 = st.columns([2, 3, 2, 1])
+        col1.write(f"{rule['start']} ~ {rule.get('end') or ''}")
+        col2.write(rule['description'])
+        col3.write(f"{format_amount(rule['amount'], rule.get('currency'))} ({FREQUENCY_LABELS[rule['frequency']]} x{rule['interval']})")
+        if col4.button("삭제", key=f"del_recurring_{rule['id']}"):
+            try:
+                data_manager.remove_recurring(rule['id'])
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success("반복 예산 삭제 성공!")
+                st.rerun()
+
     # Display and manage existing revenues
     st.subheader("기존 예산")
     df_revenue = pd.DataFrame(revenues)
@@ -46,13 +96,22 @@ def revenue_page():
             col1, col2, col3, col4 = st.columns([2, 3, 2, 1])
             col1.write(row['date'].strftime('%Y-%m-%d') if pd.notnull(row['date']) else 'No Date')
             col2.write(row['description'])
-            col3.write(f"${row['amount']:.2f}")
+            col3.write(format_amount(row['amount'], row.get('currency')))
             if col4.button("삭제", key=f"del_rev_{idx}"):
-                data_manager.remove_revenue(year,idx)
-                st.success("예산 삭제 성공!")
-                st.rerun()
+                try:
+                    data_manager.remove_revenue(year,idx)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success("예산 삭제 성공!")
+                    st.rerun()
     else:
         st.write("아직 예산이 없습니다.")
 
+    if st.button("실행 취소", disabled=not len(data_manager.history)):
+        summary = data_manager.undo()
+        st.success(f"실행 취소: {summary}")
+        st.rerun()
+
 if __name__ == "__main__":
     revenue_page()
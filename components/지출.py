@@ -1,15 +1,15 @@
 import streamlit as st
 import pandas as pd
-from utils.data_manager import DataManager
-import json
+from utils.app_data import get_data_manager
+from utils.anomaly import FLAG_LABELS
+from utils.fx import BASE_CURRENCY, available_currencies, format_amount
+from utils.recurrence import FREQUENCIES, FREQUENCY_LABELS
+from collections.abc import Mapping
 
-# Fetch the data from Streamlit secrets
-data = json.loads(st.secrets["accounting_data"]["data"])
-
-# Initialize the DataManager with the fetched data
-data_manager = DataManager(data)
 
 def costs_page():
+    # Shared with the other pages (see utils.app_data)
+    data_manager = get_data_manager()
     st.title('지출 관리')
 
     costs = data_manager.get_costs()
@@ -30,9 +30,13 @@ def costs_page():
 
         if st.button("이벤트 추가"):
             if new_event and new_event not in all_events:
-                data_manager.add_event(new_event, year)
-                st.success(f"이벤트 '{new_event}' 추가 성공!")
-                st.rerun()
+                try:
+                    data_manager.add_event(new_event, year)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"이벤트 '{new_event}' 추가 성공!")
+                    st.rerun()
             else:
                 st.error("이벤트 이름이 유효하지 않거나 이미 존재합니다.")
     
@@ -43,17 +47,35 @@ def costs_page():
 
             if events_in_year:
                 event_to_remove = st.selectbox("이벤트 삭제할 이벤트 선택", events_in_year)
+                cost_count = data_manager.count_event_costs(event_to_remove, selected_year)
+                if cost_count:
+                    st.warning(f"이 이벤트의 지출 {cost_count}건도 함께 삭제됩니다. '실행 취소'로 되돌릴 수 있습니다.")
                 if st.button("이벤트 삭제"):
-                    data_manager.remove_event(event_to_remove, selected_year)
-                    st.success(f"이벤트 '{event_to_remove}' 삭제 성공!")
-                    st.rerun()
+                    try:
+                        data_manager.remove_event(event_to_remove, selected_year)
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.success(f"이벤트 '{event_to_remove}' 삭제 성공!")
+                        st.rerun()
             else:
                 st.write("삭제할 이벤트가 없습니다.")
+
+            if data_manager.is_closed(selected_year):
+                st.write(f"{selected_year}년은 마감되었습니다.")
+            elif st.button("연도 마감"):
+                data_manager.close_year(selected_year)
+                st.success(f"{selected_year}년 마감 성공!")
+                st.rerun()
         else:
             st.write("이벤트가 없습니다.")
 
     # Add new cost
     st.subheader("새로운 지출 추가")
+    # Flags raised by the last insert survive the rerun that follows it
+    last_flags = st.session_state.pop("last_cost_flags", None)
+    if last_flags:
+        st.warning(f"방금 추가한 지출이 확인이 필요합니다: {', '.join(last_flags)}")
 
     if years:
         with st.form(key="add_cost_form"):
@@ -65,6 +87,7 @@ def costs_page():
             date = st.date_input("날짜")
             description = st.text_input("설명")
             amount = st.number_input("금액", min_value=0.01, step=0.01)
+            currency = st.selectbox("통화", available_currencies(data_manager.fx_rates), key="cost_currency")
 
             submit_button = st.form_submit_button(label="지출 추가")
 
@@ -73,16 +96,165 @@ def costs_page():
                 new_cost = {
                     "date": date.isoformat(),
                     "description": description,
-                    "amount": amount
+                    "amount": amount,
+                    "currency": currency
                 }
-                data_manager.add_cost(event, subcategory, new_cost)
-                st.success("지출 추가 성공!")
-                st.rerun()
+                try:
+                    flags = data_manager.add_cost(event, subcategory, new_cost)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.session_state["last_cost_flags"] = [FLAG_LABELS[flag] for flag in flags]
+                    st.success("지출 추가 성공!")
+                    st.rerun()
             else:
                 st.error("이벤트를 선택하세요.")
     else:
         st.write("이벤트가 없습니다. 먼저 이벤트를 추가하세요.")
     
+    # Budget vs actual
+    st.subheader("예산 대비 지출")
+
+    if years:
+        budget_year = st.selectbox("연도 선택", years, key="budget_year_select")
+        with st.form(key="set_budget_form"):
+            budget_event = st.selectbox("이벤트 선택", list(costs.get(budget_year, {}).keys()), key="budget_event_select")
+            budget_subcategory = st.selectbox("하위 카테고리 선택", data_manager.subcategories, key="budget_subcategory_select")
+            budget_amount = st.number_input("예산 금액", min_value=0.0, step=1.0)
+            budget_submitted = st.form_submit_button(label="예산 설정")
+
+        if budget_submitted and budget_event:
+            data_manager.set_budget(budget_year, budget_event, budget_subcategory, budget_amount)
+            st.success("예산 설정 성공!")
+            st.rerun()
+
+        # Spent amounts and budgets are shown in the reporting currency chosen in the sidebar
+        budget_lines = data_manager.get_budget_report(
+            budget_year, currency=st.session_state.get("reporting_currency", BASE_CURRENCY)
+        )
+        if budget_lines:
+            df_budget = pd.DataFrame(budget_lines)
+            st.dataframe(df_budget[['event', 'subcategory', 'budget', 'spent', 'remaining', 'burn_rate', 'projected_overrun']])
+            over_budget = df_budget[df_budget['projected_overrun'] > 0]
+            if not over_budget.empty:
+                st.warning(f"예산 초과 예상 항목: {len(over_budget)}개")
+        else:
+            st.write("설정된 예산이 없습니다.")
+    else:
+        st.write("이벤트가 없습니다. 먼저 이벤트를 추가하세요.")
+
+    # Recurring costs
+    st.subheader("반복 지출")
+    with st.form(key="add_recurring_cost_form"):
+        recurring_event = st.selectbox("이벤트 선택", all_events, key="recurring_cost_event")
+        recurring_subcategory = st.selectbox("하위 카테고리 선택", data_manager.subcategories, key="recurring_cost_subcategory")
+        recurring_description = st.text_input("설명", key="recurring_cost_description")
+        recurring_amount = st.number_input("금액", min_value=0.01, step=0.01, key="recurring_cost_amount")
+        recurring_currency = st.selectbox("통화", available_currencies(data_manager.fx_rates), key="recurring_cost_currency")
+        frequency = st.selectbox("반복 주기", FREQUENCIES, format_func=FREQUENCY_LABELS.get, key="recurring_cost_frequency")
+        interval = st.number_input("간격 (월/주/일)", min_value=1, step=1, value=1, key="recurring_cost_interval")
+        recurring_start = st.date_input("시작 날짜", key="recurring_cost_start")
+        recurring_end = st.date_input("종료 날짜", value=None, key="recurring_cost_end")
+        recurring_submitted = st.form_submit_button(label="반복 지출 추가")
+
+    if recurring_submitted:
+        try:
+            data_manager.add_recurring({
+                "type": "지출",
+                "event": recurring_event,
+                "subcategory": recurring_subcategory,
+                "description": recurring_description,
+                "amount": recurring_amount,
+                "currency": recurring_currency,
+                "frequency": frequency,
+                "interval": int(interval),
+                "start": recurring_start.isoformat(),
+                "end": recurring_end.isoformat() if recurring_end else None,
+            })
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success("반복 지출 추가 성공!")
+            st.rerun()
+
+    for rule in data_manager.get_recurring():
+        if rule.get("type") != "지출":
+            continue
+        col1, col2, col3, col4 = st.columns([2, 3, 2, 1])
+        col1.write(f"{rule['start']} ~ {rule.get('end') or ''}")
+        col2.write(f"{rule['event']} / {rule['subcategory']} - {rule['description']}")
+        col3.write(f"{format_amount(rule['amount'], rule.get('currency'))} ({FREQUENCY_LABELS[rule['frequency']]} x{rule['interval']})")
+        if col4.button("삭제", key=f"del_recurring_{rule['id']}"):
+            try:
+                data_manager.remove_recurring(rule['id'])
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success("반복 지출 삭제 성공!")
+                st.rerun()
+
+    # Receipts attached to a cost
+    st.subheader("영수증")
+    if years:
+        col1, col2, col3 = st.columns(3)
+        receipt_year = col1.selectbox("연도 선택", years, key="receipt_year_select")
+        receipt_event = col2.selectbox("이벤트 선택", list(costs.get(receipt_year, {}).keys()), key="receipt_event_select")
+        receipt_subcategory = col3.selectbox("하위 카테고리 선택", data_manager.subcategories, key="receipt_subcategory_select")
+        receipt_costs = costs.get(receipt_year, {}).get(receipt_event, {}).get(receipt_subcategory, ())
+        if receipt_costs:
+            receipt_index = st.selectbox(
+                "지출 선택", range(len(receipt_costs)), key="receipt_cost_select",
+                format_func=lambda i: f"{receipt_costs[i].get('date')} {receipt_costs[i].get('description')} "
+                                      f"{format_amount(receipt_costs[i].get('amount', 0), receipt_costs[i].get('currency'))}",
+            )
+            uploaded = st.file_uploader("영수증 파일", key="receipt_upload")
+            if uploaded is not None and st.button("영수증 첨부"):
+                try:
+                    data_manager.attach_receipt(receipt_year, receipt_event, receipt_subcategory, receipt_index,
+                                                uploaded, uploaded.name, uploaded.type)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success("영수증 첨부 성공!")
+                    st.rerun()
+
+            # Thumbnails are only made for the receipts shown here
+            for digest in receipt_costs[receipt_index].get("attachments", ()):
+                info = data_manager.receipts.info(digest)
+                col1, col2, col3 = st.columns([2, 3, 1])
+                thumbnail = data_manager.receipts.thumbnail(digest)
+                if thumbnail:
+                    col1.image(thumbnail)
+                with data_manager.receipts.open(digest) as f:
+                    col2.download_button(info.get("name") or digest[:12], f, file_name=info.get("name") or digest,
+                                         mime=info.get("content_type"), key=f"receipt_download_{digest}")
+                if col3.button("삭제", key=f"receipt_detach_{digest}"):
+                    try:
+                        data_manager.detach_receipt(receipt_year, receipt_event, receipt_subcategory, receipt_index, digest)
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.success("영수증 삭제 성공!")
+                        st.rerun()
+        else:
+            st.write("이 카테고리에 대한 지출이 없습니다.")
+
+    # Costs flagged as duplicates or outliers
+    st.subheader("이상 지출")
+    anomalies = data_manager.get_anomalies()
+    if anomalies:
+        st.dataframe(pd.DataFrame([{
+            'date': anomaly.transaction.entry.get('date'),
+            'event': anomaly.transaction.event,
+            'subcategory': anomaly.transaction.subcategory,
+            'description': anomaly.transaction.entry.get('description'),
+            'amount': format_amount(float(anomaly.transaction.entry.get('amount', 0) or 0), anomaly.transaction.entry.get('currency')),
+            '사유': ', '.join(FLAG_LABELS[reason] for reason in anomaly.reasons),
+            '점수': anomaly.score,
+        } for anomaly in anomalies]), hide_index=True)
+    else:
+        st.write("이상 지출이 없습니다.")
+
     # Display and manage existing costs
     st.subheader("기존 지출")
     for year, events in costs.items():
@@ -91,10 +263,11 @@ def costs_page():
         for event, subcategories in events.items():
             st.write(f"#### {event}")
             
-            if isinstance(subcategories, dict):
+            if isinstance(subcategories, Mapping):
                 for subcategory, subcategory_costs in subcategories.items():
                     st.write(f"##### {subcategory}")
                     df_costs = pd.DataFrame(subcategory_costs)
+                    cost_flags = data_manager.get_cost_flags(year, event, subcategory)
                 
                     if not df_costs.empty:
                         df_costs['date'] = pd.to_datetime(df_costs['date'])
@@ -103,19 +276,41 @@ def costs_page():
                         for idx, row in df_costs.iterrows():
                             col1, col2, col3, col4 = st.columns([2, 3, 2, 1])
                             col1.write(row['date'].strftime('%Y-%m-%d'))
-                            col2.write(row['description'])
-                            col3.write(f"${row['amount']:.2f}")
+                            description = row['description']
+                            if isinstance(row.get('attachments'), list):
+                                description = f"{description} 📎{len(row['attachments'])}"
+                            if idx in cost_flags:
+                                description = f"⚠️ {description} ({', '.join(FLAG_LABELS[flag] for flag in cost_flags[idx])})"
+                            col2.write(description)
+                            col3.write(format_amount(row['amount'], row.get('currency')))
                             
                             year = row['date'].year
 
                             if col4.button("Delete", key=f"del_cost_{event}_{subcategory}_{year}_{idx}"):
-                                data_manager.remove_cost(year, event, subcategory, idx)
-                                st.success("지출 삭제 성공!")
-                                st.rerun()
+                                try:
+                                    data_manager.remove_cost(year, event, subcategory, idx)
+                                except ValueError as e:
+                                    st.error(str(e))
+                                else:
+                                    st.success("지출 삭제 성공!")
+                                    st.rerun()
                     else:
                         st.write("이 카테고리에 대한 지출이 없습니다.")
             else:
                 st.write("이 이벤트에 대한 지출 정보가 올바르지 않습니다.")
 
+    # Undo and audit log
+    st.subheader("변경 기록")
+    if st.button("실행 취소", disabled=not len(data_manager.history)):
+        summary = data_manager.undo()
+        st.success(f"실행 취소: {summary}")
+        st.rerun()
+
+    audit_log = data_manager.get_audit_log()
+    if audit_log:
+        st.dataframe(pd.DataFrame(audit_log), hide_index=True)
+    else:
+        st.write("변경 기록이 없습니다.")
+
 if __name__ == "__main__":
     costs_page()
@@ -4,7 +4,16 @@ import plotly.express as px
 from components.예산 import revenue_page
 from components.지출 import costs_page
 from components.보고서 import reports_page
-from utils.data_manager import DataManager
+from utils.app_data import get_data_manager
+from utils.fx import BASE_CURRENCY, available_currencies, format_amount
+from utils.reports import yearly_comparison
+from utils.visualizations import (
+    amount_axis_title,
+    create_cost_treemap,
+    create_cumulative_balance_chart,
+    create_cumulative_subcategory_chart,
+    year_color_map
+)
 
 
 def check_password():
@@ -36,24 +45,16 @@ def check_password():
         # Password correct
         return True
 
+from collections.abc import Mapping
 from datetime import datetime
-import json
 
 # Set page config at the very beginning
 st.set_page_config(page_title="Accounting System",
                    page_icon="💼",
                    layout="wide")
 
-# Load the secret
-try:
-    secret_file = st.secrets["accounting_data"]["data"]
-    accounting_data = json.loads(secret_file)  # Parse the JSON string
-except json.JSONDecodeError as e:
-    st.error(f"Failed to load accounting data: {e}")
-    accounting_data = {"revenues": {}, "costs": {}}
-
-# Initialize DataManager with the secret file
-data_manager = DataManager(accounting_data)
+# The DataManager (binary snapshot or JSON string) shared by every page, session and rerun
+data_manager = get_data_manager()
 
 def main():
     if not check_password():
@@ -61,6 +62,8 @@ def main():
 
     st.sidebar.title("Navigation")
     page = st.sidebar.radio("Go to", ["전체보기", "예산", "지출", "보고서"])
+    # Every total and chart is shown in this currency
+    st.sidebar.selectbox("표시 통화", available_currencies(data_manager.fx_rates), key="reporting_currency")
 
     if page == "전체보기":
         overview_page()
@@ -76,7 +79,7 @@ def overview_page():
 
     # Year selection
     current_year = datetime.now().year
-    years = list(range(current_year - 1, current_year + 2))  # Previous year, current year, next year
+    years = sorted(set(data_manager.get_years()) | {current_year})  # Every year in the ledger, plus the current one
     selected_years = st.multiselect("연도 선택", years, default=[current_year])
 
     # Load data for selected years
@@ -85,28 +88,30 @@ def overview_page():
     for year in selected_years:
         revenues.extend(data_manager.get_revenues(year))
         year_costs = data_manager.get_costs(year)
-        if isinstance(year_costs, dict):
+        if isinstance(year_costs, Mapping):
             for event, subcategories in year_costs.items():
                 for subcategory, subcategory_costs in subcategories.items():
                     costs.extend(subcategory_costs)
-        elif isinstance(year_costs, list):
+        elif isinstance(year_costs, (list, tuple)):
             costs.extend(year_costs)
 
-    # Calculate summary
-    total_revenue = sum(item['amount'] for item in revenues if isinstance(item, dict) and 'amount' in item)
-    total_costs = sum(cost['amount'] for cost in costs if isinstance(cost, dict) and 'amount' in cost)
+    # Calculate summary from the per-year totals, which include recurring entries
+    currency = st.session_state.get("reporting_currency", BASE_CURRENCY)
+    year_totals = [data_manager.get_year_totals(year, currency) for year in selected_years]
+    total_revenue = sum(totals['수입'] for totals in year_totals)
+    total_costs = sum(totals['지출'] for totals in year_totals)
     net_balance = total_revenue - total_costs
 
     # Display summary
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Revenue", f"${total_revenue:,.2f}", delta=None)
-    col2.metric("Total Costs", f"${total_costs:,.2f}", delta=None)
-    col3.metric("Net Balance", f"${net_balance:,.2f}", delta=None)
+    col1.metric("Total Revenue", format_amount(total_revenue, currency), delta=None)
+    col2.metric("Total Costs", format_amount(total_costs, currency), delta=None)
+    col3.metric("Net Balance", format_amount(net_balance, currency), delta=None)
 
     # Display recent entries
     st.subheader("Recent Entries")
-    recent_revenues = sorted([r for r in revenues if isinstance(r, dict) and 'date' in r], key=lambda x: x['date'], reverse=True)[:5]
-    recent_costs = sorted([c for c in costs if isinstance(c, dict) and 'date' in c], key=lambda x: x['date'], reverse=True)[:5]
+    recent_revenues = sorted([r for r in revenues if isinstance(r, Mapping) and 'date' in r], key=lambda x: x['date'], reverse=True)[:5]
+    recent_costs = sorted([c for c in costs if isinstance(c, Mapping) and 'date' in c], key=lambda x: x['date'], reverse=True)[:5]
 
     col1, col2 = st.columns(2)
 
@@ -116,7 +121,7 @@ def overview_page():
         if not df_revenue.empty:
             df_revenue['date'] = pd.to_datetime(df_revenue['date'])
             df_revenue = df_revenue.sort_values('date', ascending=False)
-            st.dataframe(df_revenue[['date', 'description', 'amount']])
+            st.dataframe(df_revenue[[col for col in ['date', 'description', 'amount', 'currency'] if col in df_revenue.columns]])
         else:
             st.write("No recent revenues")
 
@@ -126,18 +131,28 @@ def overview_page():
         if not df_costs.empty:
             df_costs['date'] = pd.to_datetime(df_costs['date'])
             df_costs = df_costs.sort_values('date', ascending=False)
-            columns_to_display = ['date', 'event', 'subcategory', 'description', 'amount']
+            columns_to_display = ['date', 'event', 'subcategory', 'description', 'amount', 'currency']
             columns_to_display = [col for col in columns_to_display if col in df_costs.columns]
             st.dataframe(df_costs[columns_to_display])
         else:
             st.write("No recent costs")
 
+    # Cumulative balance with the 12-month forecast
+    st.subheader("Cumulative Balance & Forecast")
+    # The balance runs over the whole history, so every year's partition is loaded; only do it on request
+    if not st.toggle("전체 기간 잔액과 예측 보기", key="show_forecast"):
+        st.caption("전체 기간의 데이터를 불러오므로 필요할 때만 켜 주세요.")
+    else:
+        show_forecast(currency)
+
     # Year-wise breakdown
     st.subheader("Year-wise Breakdown")
     year_data = []
-    for year in selected_years:
-        year_revenues = sum(item['amount'] for item in revenues if isinstance(item, dict) and 'amount' in item and item['date'].startswith(str(year)))
-        year_costs = sum(cost['amount'] for cost in costs if isinstance(cost, dict) and 'amount' in cost and cost['date'].startswith(str(year)))
+    for year in sorted(selected_years):
+        # Per-year totals come from the aggregate index or the partition metadata, so no entries are scanned here
+        year_totals = data_manager.get_year_totals(year, currency)
+        year_revenues = year_totals['수입']
+        year_costs = year_totals['지출']
         year_data.append({"Year": year, "Revenue": year_revenues, "Costs": year_costs, "Net": year_revenues - year_costs})
     
     df_year_breakdown = pd.DataFrame(year_data)
@@ -146,6 +161,15 @@ def overview_page():
     else:
         st.dataframe(df_year_breakdown)
         
+# This function is used to draw the cumulative balance of the whole history with the 12-month forecast
+def show_forecast(currency):
+    df_all = data_manager.get_transaction_frame(currency, end_date=datetime.now().date())
+    if df_all.empty:
+        st.write("No data available for the forecast.")
+    else:
+        forecast = data_manager.get_forecast(months=12, currency=currency)
+        st.plotly_chart(create_cumulative_balance_chart(df_all, forecast, currency), use_container_width=True)
+
 def revenue_page():
     from components.예산 import revenue_page
     revenue_page()
@@ -157,94 +181,67 @@ def costs_page():
 def reports_page():
     st.title("예산 보고서")
     
-    current_year = datetime.now().year
-    last_year = current_year - 1
-
-    revenues_current = data_manager.get_revenues(current_year)
-    costs_current = data_manager.get_costs(current_year)
-    revenues_last = data_manager.get_revenues(last_year)
-    costs_last = data_manager.get_costs(last_year)
-    
-    # Prepare data for reports
-    df_revenue_current = pd.DataFrame(revenues_current)
-    if not df_revenue_current.empty:
-        df_revenue_current['date'] = pd.to_datetime(df_revenue_current['date'])
-        df_revenue_current['type'] = '수입'
-        df_revenue_current['year'] = current_year
-    
-    df_costs_current = pd.DataFrame()
-    for event, subcategories in costs_current.items():
-        for subcategory, subcategory_costs in subcategories.items():
-            df_category = pd.DataFrame(subcategory_costs)
-            df_category['event'] = event
-            df_category['subcategory'] = subcategory
-            df_costs_current = pd.concat([df_costs_current, df_category], ignore_index=True)
-
-    if not df_costs_current.empty:
-        df_costs_current['date'] = pd.to_datetime(df_costs_current['date'])
-        df_costs_current['type'] = '지출'
-        df_costs_current['year'] = current_year
-    
-    df_revenue_last = pd.DataFrame(revenues_last)
-    if not df_revenue_last.empty:
-        df_revenue_last['date'] = pd.to_datetime(df_revenue_last['date'])
-        df_revenue_last['type'] = '수입'
-        df_revenue_last['year'] = last_year
+    # Years to compare come from the ledger itself, defaulting to the two most recent ones
+    available_years = data_manager.get_years()
+    report_years = sorted(st.multiselect("비교 연도 선택", available_years, default=available_years[-2:], key="report_years"))
     
-    df_costs_last = pd.DataFrame()
-    for event, subcategories in costs_last.items():
-        for subcategory, subcategory_costs in subcategories.items():
-            df_category = pd.DataFrame(subcategory_costs)
-            df_category['event'] = event
-            df_category['subcategory'] = subcategory
-            df_costs_last = pd.concat([df_costs_last, df_category], ignore_index=True)
-
-    if not df_costs_last.empty:
-        df_costs_last['date'] = pd.to_datetime(df_costs_last['date'])
-        df_costs_last['type'] = '지출'
-        df_costs_last['year'] = last_year
-    
-    df_combined = pd.concat([df_revenue_current, df_costs_current, df_revenue_last, df_costs_last])
+    if not report_years:
+        st.warning("No data available for the selected period.")
+        return
+
+    current_year = report_years[-1]
+    last_year = report_years[-2] if len(report_years) > 1 else None
+
+    # Transactions of the selected years, already in date order from the date index
+    transactions = data_manager.get_transactions(f"{report_years[0]}-01-01", f"{current_year}-12-31", years=report_years)
     
-    if df_combined.empty:
+    if not transactions:
         st.warning("No data available for the selected period.")
         return
 
-    df_combined = df_combined.sort_values('date')
+    first_date = pd.Timestamp(transactions[0].entry['date'])
+    last_date = pd.Timestamp(transactions[-1].entry['date'])
     
     # Date range filter
-    start_date = st.date_input("Start Date", min(df_combined['date'].min(), pd.Timestamp.today()))
-    end_date = st.date_input("End Date", max(df_combined['date'].max(), pd.Timestamp.today()))
-    
-    df_filtered = df_combined[(df_combined['date'] >= pd.Timestamp(start_date)) & 
-                              (df_combined['date'] <= pd.Timestamp(end_date))]
+    start_date = st.date_input("Start Date", min(first_date, pd.Timestamp.today()))
+    end_date = st.date_input("End Date", max(last_date, pd.Timestamp.today()))
     
-    # Summary statistics
-    total_revenue_current = df_filtered[(df_filtered['type'] == '수입') & (df_filtered['year'] == current_year)]['amount'].sum()
-    total_costs_current = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'] == current_year)]['amount'].sum()
-    net_balance_current = total_revenue_current - total_costs_current
+    # Amounts converted to the reporting currency, cached per ledger version and currency
+    currency = st.session_state.get("reporting_currency", BASE_CURRENCY)
+    df_filtered = data_manager.get_transaction_frame(currency, start_date, end_date, years=report_years)
     
-    total_revenue_last = df_filtered[(df_filtered['type'] == '수입') & (df_filtered['year'] == last_year)]['amount'].sum()
-    total_costs_last = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'] == last_year)]['amount'].sum()
-    net_balance_last = total_revenue_last - total_costs_last
+    # Summary statistics for every selected year in one grouped pass
+    yearly_summary = yearly_comparison(df_filtered, report_years)
+    current = yearly_summary.loc[current_year]
+    previous = yearly_summary.loc[last_year] if last_year is not None else current * 0
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("총 수입", f"${total_revenue_current:,.2f}", f"${total_revenue_current - total_revenue_last:,.2f}")
-    col2.metric("총 지출", f"${total_costs_current:,.2f}", f"${total_costs_current - total_costs_last:,.2f}")
-    col3.metric("총 잔액", f"${net_balance_current:,.2f}", f"${net_balance_current - net_balance_last:,.2f}")
+    col1.metric("총 수입", format_amount(current['수입'], currency), format_amount(current['수입'] - previous['수입'], currency))
+    col2.metric("총 지출", format_amount(current['지출'], currency), format_amount(current['지출'] - previous['지출'], currency))
+    col3.metric("총 잔액", format_amount(current['잔액'], currency), format_amount(current['잔액'] - previous['잔액'], currency))
+    if len(report_years) > 2:
+        st.dataframe(yearly_summary)
     
     # Year-over-Year Comparison
     st.subheader("연간 비교")
-    yearly_totals = df_filtered.groupby(['year', 'event'])['amount'].sum().reset_index()
-    color_map = {2023: '#1f77b4', 2024: '#ff7f0e'}
+    # Event totals per year are a roll-up of the cost cube of the selected window, so they match the metrics above
+    cost_cube = data_manager.get_window_cube(currency, start_date, end_date, years=report_years).slice(
+        type='지출', year=report_years)
+    yearly_totals = pd.DataFrame([
+        {'year': year, 'event': event, 'amount': amount}
+        for (year, event), amount in cost_cube.roll_up('year', 'event').items()
+    ], columns=['year', 'event', 'amount'])
+    # Years as strings so plotly treats them as categories rather than a continuous scale
+    yearly_totals['year'] = yearly_totals['year'].astype(str)
+    color_map = year_color_map(report_years)
     yoy_chart = px.bar(yearly_totals, x='event', y='amount', color='year',
                        title='Year-over-Year Comparison',
-                       labels={'amount': '금액', 'event': '이벤트', 'year': '연도'},
+                       labels={'amount': amount_axis_title(currency, '금액'), 'event': '이벤트', 'year': '연도'},
                        barmode='group',
                        color_discrete_map=color_map)
     yoy_chart.update_layout(bargap=0.2, bargroupgap=0.1, xaxis={'categoryorder':'total descending'})
     for i, row in yearly_totals.iterrows():
-        yoy_chart.add_annotation(x=row['event'], y=row['amount'], text=f"${row['amount']:,.2f}",
+        yoy_chart.add_annotation(x=row['event'], y=row['amount'], text=format_amount(row['amount'], currency),
                                  showarrow=False, yshift=10, font=dict(size=9),
                                  xanchor='center', yanchor='bottom')
     yoy_chart.update_traces(offsetgroup='year')
@@ -262,45 +259,37 @@ def reports_page():
     monthly_summary_melted['date'] = monthly_summary_melted['date'].dt.to_timestamp()
     fig = px.bar(monthly_summary_melted, x='date', y='amount', color='subcategory',
                  title='Monthly Summary by Subcategory',
-                 labels={'date': '월', 'amount': '금액', 'subcategory': '하위 카테고리'})
+                 labels={'date': '월', 'amount': amount_axis_title(currency, '금액'), 'subcategory': '하위 카테고리'})
     fig.update_layout(barmode='stack', xaxis_tickformat='%Y-%m')
     st.plotly_chart(fig, use_container_width=True)
 
     # Cumulative Expenses by Subcategories
     st.subheader("누적 지출 (하위 카테고리별)")
-    selected_years = st.multiselect("연도 선택", [2023, 2024], default=[2023, 2024])
+    selected_years = st.multiselect("연도 선택", report_years, default=report_years)
     df_expenses = df_filtered[(df_filtered['type'] == '지출') & (df_filtered['year'].isin(selected_years))]
     if not df_expenses.empty:
-        df_expenses = df_expenses.sort_values('date')
-        df_cumulative = df_expenses.groupby(['date', 'subcategory'])['amount'].sum().unstack(fill_value=0).cumsum()
-        fig_cumulative = px.line(df_cumulative, x=df_cumulative.index, y=df_cumulative.columns,
-                                 title='Cumulative Expenses by Subcategory',
-                                 labels={'value': '누적 금액', 'date': '날짜', 'variable': '하위 카테고리'})
-        fig_cumulative.update_layout(legend_title_text='하위 카테고리')
+        fig_cumulative = create_cumulative_subcategory_chart(df_expenses)
         st.plotly_chart(fig_cumulative, use_container_width=True)
     else:
         st.write("선택한 기간에 대한 지출 데이터가 없습니다.")
 
     # Cost breakdown by event and subcategory
     st.subheader("지출 분석")
-    df_costs = df_filtered[df_filtered['type'] == '지출']
-    if not df_costs.empty:
-        available_years = sorted(df_costs['year'].unique())
-        selected_years = st.multiselect("연도 선", available_years, default=available_years, key="cost_breakdown_years")
-        df_costs_filtered = df_costs[df_costs['year'].isin(selected_years)]
-        df_cost_breakdown = df_costs_filtered.groupby(['year', 'event', 'subcategory'])['amount'].sum().reset_index()
-        fig_cost_breakdown = px.treemap(df_cost_breakdown, path=['year', 'event', 'subcategory'], values='amount',
-                                        title='지출 분석: 연도, 이벤트, 하위 카테고리별', color='amount',
-                                        color_continuous_scale='RdYlBu_r', hover_data=['amount'])
-        fig_cost_breakdown.update_traces(textinfo='label+value',
-                                         hovertemplate='<b>%{label}</b><br>금액: ₩%{value:,.0f}')
-        fig_cost_breakdown.update_layout(height=600, coloraxis_colorbar=dict(title='금액'))
+    cost_years = sorted(year for (year,), amount in cost_cube.roll_up('year').items() if amount)
+    if cost_years:
+        selected_years = st.multiselect("연도 선", cost_years, default=cost_years, key="cost_breakdown_years")
+        breakdown_cube = cost_cube.slice(year=selected_years)
+        df_cost_breakdown = pd.DataFrame([
+            {'year': year, 'event': event, 'subcategory': subcategory, 'amount': amount}
+            for (year, event, subcategory), amount in breakdown_cube.roll_up('year', 'event', 'subcategory').items()
+        ], columns=['year', 'event', 'subcategory', 'amount'])
+        fig_cost_breakdown = create_cost_treemap(df_cost_breakdown, currency)
         st.plotly_chart(fig_cost_breakdown, use_container_width=True)
         
         # Bar chart for top subcategories
         st.subheader("상위 지출 하위 카테고리")
         top_n = st.slider("표시할 상위 카테고리 수", min_value=5, max_value=20, value=10, key="top_subcategories_slider")
-        df_top_subcategories = df_costs_filtered.groupby('subcategory')['amount'].sum().nlargest(top_n).reset_index()
+        df_top_subcategories = pd.DataFrame(breakdown_cube.top('subcategory', top_n), columns=['subcategory', 'amount'])
         fig_top_subcategories = px.bar(df_top_subcategories, x='subcategory', y='amount',
                                        title=f'상위 {top_n} 지출 하위 카테고리',
                                        labels={'subcategory': '하위 카테고리', 'amount': '총 금액'},
@@ -338,16 +327,49 @@ def reports_page():
         df_display = df_display[df_display['event'] == selected_event]
     if selected_subcategory != "All Subcategories":
         df_display = df_display[df_display['subcategory'] == selected_subcategory]
-    df_display = df_display[(df_display['date'] >= pd.Timestamp(start_date)) & 
-                            (df_display['date'] <= pd.Timestamp(end_date))]
+    # Rows are still in date order, so the date window is two binary searches
+    lo = df_display['date'].searchsorted(pd.Timestamp(start_date), side='left')
+    hi = df_display['date'].searchsorted(pd.Timestamp(end_date), side='right')
+    df_display = df_display.iloc[lo:hi]
     
     columns_to_display = ['date', 'year', 'type', 'event', 'subcategory', 'description', 'amount']
     st.dataframe(df_display[columns_to_display])
     
     # Display total amount
     total_amount = df_display['amount'].sum()
-    st.write(f"총액: ₩{total_amount:,.0f}")    
+    st.write(f"총액: {format_amount(total_amount, currency, decimals=0)}")    
     
+    # Search transactions by description
+    st.subheader("거래 검색")
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        search_query = st.text_input("설명 검색", key="transaction_search")
+    with col2:
+        min_amount = st.number_input("최소 금액", min_value=0.0, value=0.0, step=1.0, key="search_min_amount")
+    with col3:
+        max_amount = st.number_input("최대 금액", min_value=0.0, value=0.0, step=1.0, key="search_max_amount")
+
+    if search_query:
+        hits = data_manager.search_transactions(search_query,
+                                                min_amount=min_amount or None,
+                                                max_amount=max_amount or None,
+                                                start_date=start_date, end_date=end_date)
+        if hits:
+            df_hits = pd.DataFrame([{
+                'date': hit.transaction.entry.get('date'),
+                'year': hit.transaction.year,
+                'type': hit.transaction.type,
+                'event': hit.transaction.event,
+                'subcategory': hit.transaction.subcategory,
+                'description': hit.transaction.entry.get('description'),
+                'amount': hit.transaction.entry.get('amount'),
+                'currency': hit.transaction.entry.get('currency') or BASE_CURRENCY,
+                'score': hit.score,
+            } for hit in hits])
+            st.dataframe(df_hits)
+        else:
+            st.write("검색 결과가 없습니다.")
+
     # Export data
     if st.button("데이터를 CSV로 내보내기"):
         csv = df_filtered.to_csv(index=False)
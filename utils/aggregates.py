@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from utils.fx import BASE_CURRENCY
+
+
+class AggregateIndex:
+    """
+    Running totals kept up to date from DataManager add/remove calls.
+
+    - `year_totals[(type, year)]` is the total per transaction type and year
+    - `cost_totals[year][(event, subcategory)]` is the spent amount per event/subcategory
+    - `monthly_totals[(type, "YYYY-MM")]` is the total per type and calendar month
+    - `monthly_detail[(type, "YYYY-MM", event, subcategory)]` splits the monthly totals by event/subcategory
+    - `currency_detail[(type, year, "YYYY-MM", event, subcategory, currency)]` additionally splits by currency
+
+    Amounts are summed as entered; `currency_detail` is what a conversion to another currency starts from.
+    Reading a total is a dict lookup, so nothing needs to rescan the ledger.
+    """
+
+    def __init__(self):
+        self.year_totals = defaultdict(float)
+        self.cost_totals = defaultdict(lambda: defaultdict(float))
+        self.monthly_totals = defaultdict(float)
+        self.monthly_detail = defaultdict(float)
+        self.currency_detail = defaultdict(float)
+        self._counts = defaultdict(int)
+
+    # This method is used to fold one transaction into the totals with the given sign
+    def _apply(self, transaction, sign):
+        amount = sign * float(transaction.entry.get("amount", 0) or 0)
+        month = (transaction.entry.get("date") or "")[:7]
+        self.year_totals[(transaction.type, transaction.year)] += amount
+        self.monthly_totals[(transaction.type, month)] += amount
+        self.monthly_detail[(transaction.type, month, transaction.event, transaction.subcategory)] += amount
+        currency = transaction.entry.get("currency") or BASE_CURRENCY
+        key = (transaction.type, transaction.year, month, transaction.event, transaction.subcategory, currency)
+        self.currency_detail[key] += amount
+        self._counts[key] += sign
+        if self._counts[key] == 0:
+            del self._counts[key]
+            del self.currency_detail[key]
+        if transaction.event is not None:
+            key = (transaction.event, transaction.subcategory)
+            self.cost_totals[transaction.year][key] += amount
+            self._counts[(transaction.year, key)] += sign
+            if self._counts[(transaction.year, key)] == 0:
+                del self._counts[(transaction.year, key)]
+                del self.cost_totals[transaction.year][key]
+
+    def add(self, transaction):
+        self._apply(transaction, 1)
+
+    def remove(self, transaction):
+        self._apply(transaction, -1)
+
+    # This method is used to get the spent amount of one event/subcategory in a year
+    def spent(self, year, event, subcategory):
+        return self.cost_totals.get(int(year), {}).get((event, subcategory), 0.0)
+
+    # This method is used to list the currencies entered in a year
+    def currencies(self, year):
+        year = int(year)
+        return {key[5] for key in self.currency_detail if key[1] == year}
+
+    # This method is used to get the total of a transaction type in a year
+    def total(self, kind, year):
+        return self.year_totals.get((kind, int(year)), 0.0)
@@ -0,0 +1,251 @@
+import bisect
+import itertools
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from statistics import median
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils.fx import BASE_CURRENCY
+
+FLAG_LABELS = {"duplicate": "중복 의심", "outlier": "이상 금액"}
+
+# A flagged cost: `reasons` holds codes from FLAG_LABELS, `score` the robust z-score (None if not scored)
+Anomaly = namedtuple("Anomaly", ["transaction", "reasons", "score"])
+# One amount in a rolling window; `order` breaks ties between equal dates in insertion order
+WindowItem = namedtuple("WindowItem", ["date", "order", "key", "amount"])
+
+
+def _robust_score(amount, median_amount, mad, mean_ad):
+    """
+    Modified z-score 0.6745 * (x - median) / MAD. When more than half the history is identical
+    the MAD is 0, so the mean absolute deviation (scaled by 1.2533) stands in for it.
+    """
+    if mad:
+        return 0.6745 * (amount - median_amount) / mad
+    if mean_ad:
+        return (amount - median_amount) / (1.2533 * mean_ad)
+    return 0.0 if amount == median_amount else float("inf")
+
+
+# This function is used to score a whole history of costs in one pass
+def detect(frame, window=50, min_history=8, threshold=3.5, history=None):
+    """
+    Vectorized backfill over a frame with date, event, subcategory, currency, description and amount columns.
+
+    Rows are taken in date order within each (event, subcategory, currency) group. Each row is
+    compared with the up to `window` amounts before it, through a sliding-window matrix, and
+    exact repeats of (date, amount, description) are marked as duplicates. `history` optionally
+    holds earlier (date, event, subcategory, currency, amount) rows that count as preceding
+    amounts but are not scored themselves. Returns `frame` with `score`, `outlier` and
+    `duplicate` columns added, in the original row order.
+    """
+    frame = frame.copy()
+    frame['currency'] = frame['currency'].fillna(BASE_CURRENCY)
+    frame['amount'] = pd.to_numeric(frame['amount'], errors='coerce').fillna(0.0)
+    keys = ['event', 'subcategory', 'currency']
+    frame['duplicate'] = frame.duplicated(keys + ['date', 'amount', 'description'], keep='first')
+    frame['score'] = np.nan
+
+    rows = frame[keys + ['date', 'amount']].assign(row=np.arange(len(frame)))
+    if history is not None and not history.empty:
+        rows = pd.concat([history[keys + ['date', 'amount']].assign(row=-1), rows], ignore_index=True)
+    ordered = rows.sort_values('date', kind='stable')
+    score_column = frame.columns.get_loc('score')
+    for _, group in ordered.groupby(keys, sort=False):
+        amounts = group['amount'].to_numpy(dtype=float)
+        if len(amounts) <= min_history:
+            continue
+        # Row i of `preceding` holds the `window` amounts before row i, NaN-padded at the start
+        padded = np.concatenate([np.full(window, np.nan), amounts[:-1]])
+        preceding = sliding_window_view(padded, window)
+        positions = group['row'].to_numpy()
+        scored = ((~np.isnan(preceding)).sum(axis=1) >= min_history) & (positions >= 0)
+        history_rows, current = preceding[scored], amounts[scored]
+        if not len(current):
+            continue
+        med = np.nanmedian(history_rows, axis=1)
+        deviation = np.abs(history_rows - med[:, None])
+        mad = np.nanmedian(deviation, axis=1)
+        mean_ad = np.nanmean(deviation, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(mad > 0, 0.6745 * (current - med) / mad, (current - med) / (1.2533 * mean_ad))
+        score = np.where((mad == 0) & (mean_ad == 0), np.where(current == med, 0.0, np.inf), score)
+        frame.iloc[positions[scored], score_column] = score
+    frame['outlier'] = frame['score'].abs() > threshold
+    return frame
+
+
+class AnomalyIndex:
+    """
+    Flags suspicious costs as they are added, kept up to date from DataManager add/remove calls.
+
+    Per (event, subcategory, currency) it keeps the latest `window` amounts by date and a counter
+    of (date, amount, description) hashes. A new cost is an outlier when its robust z-score against
+    the rolling median/MAD exceeds `threshold`, and a duplicate when its hash was already seen.
+    The window is bounded, so checking one insert costs the same however long the history is.
+
+    Batches (the initial load, a lazily loaded year) go through the vectorized `detect` instead,
+    with the current windows as preceding history. A batch row is scored against the costs dated
+    before it, like a single insert, except that a backdated single insert is compared with the
+    window as it stands, later amounts included.
+
+    A flag belongs to its entry: replacing an entry with a copy that only differs in fields the
+    detector does not read (like attachments) moves the flag, and putting back a removed entry
+    (undo) restores the flag it had instead of scoring it again.
+    """
+
+    def __init__(self, window=50, min_history=8, threshold=3.5, max_removed=1000):
+        self.window = window
+        self.min_history = min_history
+        self.threshold = threshold
+        self.flags = {}
+        self._windows = defaultdict(list)
+        self._hashes = defaultdict(Counter)
+        self._order = itertools.count()
+        # Recently removed transactions and their flags, so undo can put them back as they were
+        self._removed = OrderedDict()
+        self.max_removed = max_removed
+
+    @staticmethod
+    def _key(transaction):
+        return transaction.event, transaction.subcategory, transaction.entry.get("currency") or BASE_CURRENCY
+
+    @staticmethod
+    def _fingerprint(transaction, amount):
+        return hash((transaction.entry.get("date"), amount, transaction.entry.get("description")))
+
+    @staticmethod
+    def _amount(transaction):
+        return float(transaction.entry.get("amount", 0) or 0)
+
+    # This method is used to put an amount into its window, dropping the oldest once the window is full
+    def _insert(self, key, transaction, amount):
+        window = self._windows[key]
+        bisect.insort(window, WindowItem(transaction.entry.get("date") or "", next(self._order), transaction.key, amount))
+        if len(window) > self.window:
+            del window[0]
+
+    def add(self, transaction):
+        if transaction.event is None:
+            return
+        key = self._key(transaction)
+        amount = self._amount(transaction)
+        fingerprint = self._fingerprint(transaction, amount)
+        stashed = self._removed.pop(transaction.key, None)
+        if stashed is not None:
+            # The same entry is back (undo of a removal): keep the verdict it had
+            self._hashes[key][fingerprint] += 1
+            self._insert(key, transaction, amount)
+            if stashed[1] is not None:
+                self.flags[transaction.key] = stashed[1]._replace(transaction=transaction)
+            return
+
+        reasons = []
+        if self._hashes[key][fingerprint]:
+            reasons.append("duplicate")
+        self._hashes[key][fingerprint] += 1
+
+        score = None
+        amounts = [item.amount for item in self._windows[key]]
+        if len(amounts) >= self.min_history:
+            median_amount = median(amounts)
+            deviations = [abs(value - median_amount) for value in amounts]
+            score = _robust_score(amount, median_amount, median(deviations), sum(deviations) / len(deviations))
+            if abs(score) > self.threshold:
+                reasons.append("outlier")
+        self._insert(key, transaction, amount)
+        if reasons:
+            self.flags[transaction.key] = Anomaly(transaction, tuple(reasons), score)
+
+    # This method is used to score a batch of transactions with the vectorized backfill
+    def add_many(self, transactions):
+        costs = [transaction for transaction in transactions if transaction.event is not None]
+        if not costs:
+            return
+        batch = pd.DataFrame({
+            'date': [transaction.entry.get('date') for transaction in costs],
+            'event': [transaction.event for transaction in costs],
+            'subcategory': [transaction.subcategory for transaction in costs],
+            'currency': [transaction.entry.get('currency') for transaction in costs],
+            'description': [transaction.entry.get('description') for transaction in costs],
+            'amount': [transaction.entry.get('amount', 0) for transaction in costs],
+        })
+        # The amounts already in the windows of the batch's groups count as history
+        batch_keys = set(zip(batch['event'], batch['subcategory'], batch['currency'].fillna(BASE_CURRENCY)))
+        history = pd.DataFrame(
+            [(item.date, *key, item.amount) for key in batch_keys for item in self._windows.get(key, ())],
+            columns=['date', 'event', 'subcategory', 'currency', 'amount'],
+        )
+        frame = detect(batch, self.window, self.min_history, self.threshold, history)
+
+        # Carry the batch into the streaming state: hashes (checked against what was there before
+        # the batch), then the latest amounts of each window by date
+        columns = {column: frame[column].tolist() for column in ('event', 'subcategory', 'currency', 'date', 'amount', 'description')}
+        keys = list(zip(columns['event'], columns['subcategory'], columns['currency']))
+        fingerprints = [hash(values) for values in zip(columns['date'], columns['amount'], columns['description'])]
+        seen_before = np.array([key in self._hashes and fingerprint in self._hashes[key]
+                                for key, fingerprint in zip(keys, fingerprints)], dtype=bool)
+        for key, fingerprint in zip(keys, fingerprints):
+            self._hashes[key][fingerprint] += 1
+        added = defaultdict(list)
+        for transaction, key, amount in zip(costs, keys, columns['amount']):
+            added[key].append(WindowItem(transaction.entry.get('date') or "", next(self._order), transaction.key, amount))
+        for key, items in added.items():
+            self._windows[key] = sorted(self._windows.get(key, []) + items)[-self.window:]
+
+        duplicate = frame['duplicate'].to_numpy() | seen_before
+        outlier = frame['outlier'].to_numpy()
+        for row in np.flatnonzero(duplicate | outlier):
+            reasons = tuple(reason for reason, flagged in (("duplicate", duplicate[row]), ("outlier", outlier[row])) if flagged)
+            score = frame['score'].iat[row]
+            self.flags[costs[row].key] = Anomaly(costs[row], reasons, None if np.isnan(score) else float(score))
+
+    def remove(self, transaction):
+        if transaction.event is None:
+            return
+        key = self._key(transaction)
+        amount = self._amount(transaction)
+        fingerprint = self._fingerprint(transaction, amount)
+        self._hashes[key][fingerprint] -= 1
+        if self._hashes[key][fingerprint] <= 0:
+            del self._hashes[key][fingerprint]
+        self._windows[key] = [item for item in self._windows[key] if item.key != transaction.key]
+        # Holding the transaction keeps its entry alive, so its id-based key cannot be reused meanwhile
+        self._removed[transaction.key] = (transaction, self.flags.pop(transaction.key, None))
+        if len(self._removed) > self.max_removed:
+            self._removed.popitem(last=False)
+
+    # This method is used to swap a transaction for an updated copy of its entry
+    def replace(self, old, new):
+        """
+        When the copy has the same group, date, amount and description, the flag and the window slot
+        move to the new key and nothing is scored again; otherwise it is a remove and an add.
+        """
+        if old.event is None or new.event is None or (
+            self._key(old) != self._key(new) or self._amount(old) != self._amount(new)
+            or old.entry.get("date") != new.entry.get("date")
+            or old.entry.get("description") != new.entry.get("description")
+        ):
+            self.remove(old)
+            self.add(new)
+            return
+        key = self._key(old)
+        self._windows[key] = [item._replace(key=new.key) if item.key == old.key else item for item in self._windows[key]]
+        anomaly = self.flags.pop(old.key, None)
+        if anomaly is not None:
+            self.flags[new.key] = anomaly._replace(transaction=new)
+
+    # This method is used to get the flags of one transaction (empty when it is not suspicious)
+    def reasons(self, key):
+        anomaly = self.flags.get(key)
+        return anomaly.reasons if anomaly else ()
+
+    # This method is used to list the flagged costs, newest first
+    def flagged(self, year=None):
+        anomalies = [
+            anomaly for anomaly in self.flags.values()
+            if year is None or anomaly.transaction.year == int(year)
+        ]
+        return sorted(anomalies, key=lambda anomaly: anomaly.transaction.entry.get("date") or "", reverse=True)
@@ -0,0 +1,27 @@
+import json
+
+import streamlit as st
+
+from utils.data_manager import DataManager
+from utils.ledger_codec import LedgerFormatError
+
+
+# This function is used to load the ledger from the Streamlit secrets once per server process
+@st.cache_resource
+def load_data_manager():
+    """
+    Every page and every session shares this DataManager, so writes made on one page show up on
+    the others and its indexes and per-version caches survive reruns. Sessions run in their own
+    threads; DataManager serializes writes, undo and lazy loads with its own lock.
+    A failed load raises and is not cached, so the next rerun tries again.
+    """
+    return DataManager.from_secrets(st.secrets["accounting_data"])
+
+
+# This function is used to get the shared DataManager, or an empty one when the secrets cannot be read
+def get_data_manager():
+    try:
+        return load_data_manager()
+    except (KeyError, json.JSONDecodeError, LedgerFormatError) as e:
+        st.error(f"Failed to load accounting data: {e}")
+        return DataManager({"revenues": {}, "costs": {}})
@@ -0,0 +1,233 @@
+"""
+Headless year-end report generation.
+
+    python -m utils.batch_reports ledgers/*.json --years 2023 2024 --out reports
+
+Every (ledger, year) pair is one job, rendered in a process pool. A job writes
+`<out>/<ledger>/<year>/index.html` (yearly summary, cost treemap, cumulative balance)
+and one `event-<name>.html` statement per event, using the same aggregates as the
+Streamlit reports page. Ledgers or events whose names reduce to the same directory or
+file name get a short hash suffix instead of overwriting each other. Figures are Plotly offline HTML sharing a single
+`plotly.min.js` at the root of the output directory, so no browser or network is needed.
+A timing summary is printed and written to `<out>/summary.csv`.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.express as px
+from plotly.offline import get_plotlyjs
+
+from utils.data_manager import DataManager
+from utils.fx import BASE_CURRENCY, format_amount, load_rates
+from utils.ledger_codec import MAGIC, PARTITIONED_VERSION, PartitionedSnapshot, decode, snapshot_version
+from utils.reports import cost_breakdown, event_statement, yearly_comparison
+from utils.visualizations import create_cost_treemap, create_cumulative_balance_chart
+
+PLOTLY_JS = "plotly.min.js"
+
+# Ledgers already loaded by this worker process, so jobs for other years of the same ledger reuse them
+_ledgers = {}
+
+
+# This function is used to load a ledger file (JSON or binary snapshot) once per process
+def load_ledger(path, fx_path=None):
+    if path not in _ledgers:
+        rates = load_rates(fx_path) if fx_path else None
+        with open(path, "rb") as f:
+            blob = f.read()
+        if blob.startswith(MAGIC):
+            data_manager = DataManager.from_snapshot(blob)
+            if rates is not None:
+                data_manager.fx_rates = rates
+        else:
+            data_manager = DataManager(json.loads(blob.decode("utf-8")), fx_rates=rates)
+        _ledgers[path] = data_manager
+    return _ledgers[path]
+
+
+def _slug(name):
+    return re.sub(r"[^\w-]+", "_", str(name)).strip("_") or "event"
+
+
+def _ledger_slug(path):
+    return _slug(os.path.splitext(os.path.basename(path))[0])
+
+
+# This function is used to give every name its own slug, adding a short hash where slugs would clash
+def _unique_slugs(names, slug=_slug):
+    """
+    Return {name: slug}. Names whose slugs collide (e.g. "A/B" and "A B", or a.json and a.bin)
+    all get a suffix from the hash of the name, so no file silently overwrites another.
+    """
+    groups = {}
+    for name in dict.fromkeys(names):
+        groups.setdefault(slug(name), []).append(name)
+    return {
+        name: base if len(clashing) == 1 else f"{base}-{hashlib.sha1(str(name).encode('utf-8')).hexdigest()[:8]}"
+        for base, clashing in groups.items()
+        for name in clashing
+    }
+
+
+def _page(title, body, script):
+    return (
+        f'<!DOCTYPE html><html lang="ko"><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+        f'<script src="{script}"></script></head><body><h1>{html.escape(title)}</h1>{body}</body></html>'
+    )
+
+
+def _figure(fig):
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def _table(df, currency):
+    formatters = {column: lambda value: format_amount(value, currency) for column in ("amount", "수입", "지출", "잔액")}
+    return df.to_html(index=False, formatters={k: v for k, v in formatters.items() if k in df.columns}, border=0)
+
+
+# This function is used to render the reports of one ledger and year
+def render_job(ledger_path, year, out_dir, currency=BASE_CURRENCY, events=None, fx_path=None, ledger_dir=None):
+    """
+    Render the summary page and the per-event statements of `year` and return a timing record.
+    Runs in a worker process; everything it needs is passed as plain arguments. `ledger_dir`
+    is the ledger's directory name under `out_dir` (see _unique_slugs).
+    """
+    started = time.perf_counter()
+    data_manager = load_ledger(ledger_path, fx_path)
+    loaded = time.perf_counter()
+
+    df = data_manager.get_transaction_frame(currency, years=[year])
+    target = os.path.join(out_dir, ledger_dir or _ledger_slug(ledger_path), str(year))
+    os.makedirs(target, exist_ok=True)
+    # plotly.min.js is written once at the output root; pages load it relative to their own directory
+    script = os.path.relpath(os.path.join(out_dir, PLOTLY_JS), target).replace(os.sep, "/")
+
+    summary = yearly_comparison(df, [year]).reset_index()
+    breakdown = cost_breakdown(df)
+    body = [f"<h2>요약</h2>{_table(summary, currency)}"]
+    if not breakdown.empty:
+        body.append(_figure(create_cost_treemap(breakdown, currency)))
+    if not df.empty:
+        body.append(_figure(create_cumulative_balance_chart(df, currency=currency)))
+
+    event_names = sorted(breakdown['event'].dropna().unique())
+    if events:
+        event_names = [event for event in event_names if event in events]
+    event_slugs = _unique_slugs(event_names)
+    links = []
+    for event in event_names:
+        entries, totals = event_statement(df, event)
+        filename = f"event-{event_slugs[event]}.html"
+        fig = px.bar(totals.reset_index(), x='subcategory', y='amount',
+                     labels={'subcategory': '하위 카테고리', 'amount': '금액'}, title=f'{event} 하위 카테고리별 지출')
+        statement = (
+            f"<p>총액: {format_amount(totals.sum(), currency)}</p>"
+            f"{_table(totals.reset_index(), currency)}{_figure(fig)}"
+            f"<h2>거래 목록</h2>{_table(entries[['date', 'subcategory', 'description', 'amount']], currency)}"
+        )
+        with open(os.path.join(target, filename), "w", encoding="utf-8") as f:
+            f.write(_page(f"{year}년 {event} 지출 명세", statement, script))
+        links.append(f'<li><a href="{filename}">{html.escape(str(event))}</a></li>')
+    body.append(f"<h2>이벤트별 명세</h2><ul>{''.join(links)}</ul>")
+
+    with open(os.path.join(target, "index.html"), "w", encoding="utf-8") as f:
+        f.write(_page(f"{year}년 보고서", "".join(body), script))
+
+    finished = time.perf_counter()
+    return {
+        "ledger": ledger_path,
+        "year": year,
+        "output": os.path.relpath(target, out_dir),
+        "transactions": len(df),
+        "events": len(event_names),
+        "load_seconds": round(loaded - started, 3),
+        "render_seconds": round(finished - loaded, 3),
+        "worker": os.getpid(),
+    }
+
+
+# This function is used to read the years of a ledger file without building a DataManager
+def ledger_years(path):
+    """
+    Partitioned snapshots answer from their header; JSON ledgers and format 1 snapshots are only
+    parsed, so no index is built here.
+    """
+    with open(path, "rb") as f:
+        blob = f.read()
+    if blob.startswith(MAGIC):
+        if snapshot_version(blob) == PARTITIONED_VERSION:
+            return sorted(int(year) for year in PartitionedSnapshot(blob).partitions)
+        data = decode(blob)
+    else:
+        data = json.loads(blob.decode("utf-8"))
+    return sorted(int(year) for year in set(data.get("revenues", {})) | set(data.get("costs", {})))
+
+
+# This function is used to list the (ledger, year) jobs to render
+def plan_jobs(ledger_paths, years=None):
+    """
+    Only the year lists are read here; every worker loads the ledgers of its own jobs, so the
+    loading is parallelised too and `load_seconds` in the summary is the real cost.
+    """
+    jobs = []
+    for path in ledger_paths:
+        available = ledger_years(path)
+        for year in available if not years else [year for year in years if year in available]:
+            jobs.append((path, year))
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render year-end reports for many ledgers without the Streamlit app.")
+    parser.add_argument("ledgers", nargs="+", help="ledger JSON files or binary snapshots")
+    parser.add_argument("--years", nargs="*", type=int, help="years to render (default: every year in each ledger)")
+    parser.add_argument("--events", nargs="*", help="only write statements for these events")
+    parser.add_argument("--out", default="reports", help="output directory")
+    parser.add_argument("--currency", default=BASE_CURRENCY, help="reporting currency")
+    parser.add_argument("--fx-rates", help="FX rate table (default: fx_rates.csv)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, PLOTLY_JS), "w", encoding="utf-8") as f:
+        f.write(get_plotlyjs())
+
+    ledgers = list(dict.fromkeys(args.ledgers))
+    ledger_dirs = _unique_slugs(ledgers, _ledger_slug)
+    jobs = plan_jobs(ledgers, args.years)
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(jobs) or 1))) as pool:
+        futures = {
+            pool.submit(render_job, path, year, args.out, args.currency, args.events, args.fx_rates,
+                        ledger_dirs[path]): (path, year)
+            for path, year in jobs
+        }
+        for future in as_completed(futures):
+            path, year = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"{path} {year}: failed: {e}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    summary = pd.DataFrame(results, columns=[
+        "ledger", "year", "output", "transactions", "events", "load_seconds", "render_seconds", "worker",
+    ]).sort_values(["ledger", "year"])
+    summary.to_csv(os.path.join(args.out, "summary.csv"), index=False)
+    print(summary.to_string(index=False))
+    print(f"{len(results)}/{len(jobs)} reports in {elapsed:.1f}s "
+          f"(render time {summary['render_seconds'].sum():.1f}s across {summary['worker'].nunique()} workers)")
+    return 0 if len(results) == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Pillow is optional: without it attachments are stored and served, only thumbnails are skipped
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "receipts")
+CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = (256, 256)
+
+
+class BlobStore:
+    """
+    Local content-addressed store for receipt files.
+
+    A file is stored once under the SHA-256 of its bytes (`objects/ab/cdef...`), so uploading
+    the same receipt twice keeps one copy, and ledger entries only hold the hex digest.
+    Uploads are copied in `CHUNK_SIZE` pieces to a temporary file while being hashed, so a
+    file is never held in memory as a whole. Thumbnails are made on first request and kept
+    under `thumbnails/`.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    # This method is used to get the path of a stored object
+    def path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    # This method is used to store a file-like object and return its digest
+    def put(self, fileobj, name=None, content_type=None, chunk_size=CHUNK_SIZE):
+        """
+        Stream `fileobj` into the store and return its SHA-256 hex digest.
+        If the same content is already stored, the new copy is discarded.
+        """
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        sha256 = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+                    sha256.update(chunk)
+                    temp.write(chunk)
+            digest = sha256.hexdigest()
+            target = self.path(digest)
+            if os.path.exists(target):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(temp_path, target)
+                with open(target + ".json", "w", encoding="utf-8") as f:
+                    json.dump({"name": name, "content_type": content_type, "size": os.path.getsize(target)}, f,
+                              ensure_ascii=False)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    # This method is used to open a stored object for reading
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    # This method is used to read the name, content type and size recorded with an object
+    def info(self, digest):
+        try:
+            with open(self.path(digest) + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"name": None, "content_type": None, "size": os.path.getsize(self.path(digest))}
+
+    # This method is used to get (and create on first use) the thumbnail of an image object
+    def thumbnail(self, digest, size=THUMBNAIL_SIZE):
+        """
+        Return the path of a PNG thumbnail, or None when Pillow is not installed or the object is not an image.
+        """
+        if Image is None:
+            return None
+        target = os.path.join(self.root, "thumbnails", f"{digest}-{size[0]}x{size[1]}.png")
+        if not os.path.exists(target):
+            try:
+                with Image.open(self.path(digest)) as image:
+                    image.thumbnail(size)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    image.convert("RGB").save(target, "PNG")
+            except OSError:
+                return None
+        return target
+
+    # This method is used to delete the objects no ledger entry refers to any more
+    def prune(self, referenced):
+        """
+        Remove every stored object (and its thumbnails) whose digest is not in `referenced`.
+        Returns the number of objects removed.
+        """
+        removed = 0
+        objects = os.path.join(self.root, "objects")
+        if not os.path.isdir(objects):
+            return removed
+        for prefix in os.listdir(objects):
+            for rest in os.listdir(os.path.join(objects, prefix)):
+                if rest.endswith(".json") or prefix + rest in referenced:
+                    continue
+                digest = prefix + rest
+                os.remove(self.path(digest))
+                if os.path.exists(self.path(digest) + ".json"):
+                    os.remove(self.path(digest) + ".json")
+                thumbnails = os.path.join(self.root, "thumbnails")
+                if os.path.isdir(thumbnails):
+                    for thumbnail in os.listdir(thumbnails):
+                        if thumbnail.startswith(digest):
+                            os.remove(os.path.join(thumbnails, thumbnail))
+                removed += 1
+        return removed
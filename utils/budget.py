@@ -0,0 +1,75 @@
+from collections import namedtuple
+from datetime import date
+
+BudgetLine = namedtuple("BudgetLine", [
+    "year", "event", "subcategory", "budget", "spent", "remaining",
+    "burn_rate", "projected", "projected_overrun",
+])
+
+
+def year_progress(year, as_of=None):
+    """
+    Return (elapsed_days, total_days) of `year` as of the given date.
+    Past years count as fully elapsed and future years as not started.
+    """
+    as_of = as_of or date.today()
+    start = date(year, 1, 1)
+    total_days = (date(year + 1, 1, 1) - start).days
+    elapsed_days = min(max((as_of - start).days + 1, 0), total_days)
+    return elapsed_days, total_days
+
+
+class VarianceEngine:
+    """
+    Compares budget allocations with running cost totals, given as {year: {(event, subcategory): spent}}
+    (AggregateIndex.cost_totals, or the same totals converted to a reporting currency).
+    Each line is a couple of dict lookups, so the report can be rebuilt on every rerun.
+    """
+
+    def __init__(self, cost_totals, budgets, extra_spent=None):
+        self.cost_totals = cost_totals
+        self.budgets = budgets
+        # Spending that is not in the aggregates, such as recurring costs, keyed by (event, subcategory)
+        self.extra_spent = extra_spent or {}
+
+    # This method is used to get the spent amount of one event/subcategory in a year
+    def spent(self, year, event, subcategory):
+        return self.cost_totals.get(int(year), {}).get((event, subcategory), 0.0)
+
+    # This method is used to build one budget line from the budget and spent amounts
+    def line(self, year, event, subcategory, budget, as_of=None):
+        spent = self.spent(year, event, subcategory) + self.extra_spent.get((event, subcategory), 0.0)
+        elapsed_days, total_days = year_progress(int(year), as_of)
+        burn_rate = spent / elapsed_days if elapsed_days else 0.0
+        projected = burn_rate * total_days if elapsed_days else spent
+        return BudgetLine(
+            year=int(year),
+            event=event,
+            subcategory=subcategory,
+            budget=budget,
+            spent=spent,
+            remaining=budget - spent,
+            burn_rate=burn_rate,
+            projected=projected,
+            projected_overrun=max(projected - budget, 0.0),
+        )
+
+    # This method is used to compare planned and spent amounts for a year
+    def report(self, year, as_of=None, include_unbudgeted=True):
+        """
+        Return a BudgetLine for every (event, subcategory) allocation in `year`.
+        With `include_unbudgeted`, spending on lines that have no allocation is listed with a zero budget.
+        """
+        year = str(year)
+        lines = []
+        budgeted = set()
+        for event, subcategories in self.budgets.get(year, {}).items():
+            for subcategory, budget in subcategories.items():
+                budgeted.add((event, subcategory))
+                lines.append(self.line(year, event, subcategory, float(budget), as_of))
+        if include_unbudgeted:
+            spent_keys = set(self.cost_totals.get(int(year), {})) | set(self.extra_spent)
+            for event, subcategory in sorted(spent_keys - budgeted):
+                if self.spent(year, event, subcategory) or self.extra_spent.get((event, subcategory)):
+                    lines.append(self.line(year, event, subcategory, 0.0, as_of))
+        return lines
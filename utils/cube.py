@@ -0,0 +1,142 @@
+import heapq
+from collections import defaultdict
+
+DIMENSIONS = ("year", "month", "event", "subcategory", "type")
+
+
+def _matches(value, criterion):
+    if isinstance(criterion, slice):
+        return (criterion.start is None or value >= criterion.start) and (criterion.stop is None or value <= criterion.stop)
+    if isinstance(criterion, (set, frozenset, list, tuple)):
+        return value in criterion
+    return value == criterion
+
+
+def _freeze(criterion):
+    if isinstance(criterion, slice):
+        return ("between", criterion.start, criterion.stop)
+    if isinstance(criterion, (set, frozenset, list, tuple)):
+        return frozenset(criterion)
+    return criterion
+
+
+class Cube:
+    """
+    OLAP-style cube of amounts over (year, month, event, subcategory, type), kept up to date
+    from DataManager add/remove calls.
+
+    Every cell holds the total of one (year, "YYYY-MM", event, subcategory, type) combination, so
+    the cube is as large as the number of distinct combinations, not the number of entries.
+    Queries never touch the entries:
+
+    - `roll_up(*dimensions)` totals the cells over the given dimensions
+    - `slice(**criteria)` restricts the cube (a value, a collection of values, or a `slice(lo, hi)` range, inclusive)
+    - `drill_down(coordinates, dimension)` breaks one rolled-up cell down by a further dimension
+
+    Roll-up results are cached until the next add/remove.
+    """
+
+    def __init__(self):
+        self.cells = defaultdict(float)
+        self._counts = defaultdict(int)
+        self.version = 0
+        self._rollups = {}
+
+    # This method is used to build a cube from precomputed cells, e.g. converted to another currency
+    @classmethod
+    def from_cells(cls, cells):
+        cube = cls()
+        for coordinates, amount in cells:
+            cube.cells[coordinates] += amount
+            cube._counts[coordinates] += 1
+        return cube
+
+    # This method is used to fold one transaction into its cell with the given sign
+    def _apply(self, transaction, sign):
+        coordinates = (
+            transaction.year,
+            (transaction.entry.get("date") or "")[:7],
+            transaction.event,
+            transaction.subcategory,
+            transaction.type,
+        )
+        self.cells[coordinates] += sign * float(transaction.entry.get("amount", 0) or 0)
+        self._counts[coordinates] += sign
+        if self._counts[coordinates] == 0:
+            del self._counts[coordinates]
+            del self.cells[coordinates]
+        self.version += 1
+        self._rollups.clear()
+
+    def add(self, transaction):
+        self._apply(transaction, 1)
+
+    def remove(self, transaction):
+        self._apply(transaction, -1)
+
+    # This method is used to restrict the cube to the cells matching the criteria
+    def slice(self, **criteria):
+        return CubeSlice(self, criteria)
+
+    # This method is used to total the cells over some dimensions
+    def roll_up(self, *dimensions, **criteria):
+        """
+        Return {(value of each dimension, ...): total} for the cells matching `criteria`.
+        With no dimensions the result has a single () key holding the grand total.
+        """
+        unknown = set(dimensions) - set(DIMENSIONS) | set(criteria) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimensions: {sorted(unknown)}")
+        cache_key = (dimensions, frozenset((name, _freeze(value)) for name, value in criteria.items()))
+        if cache_key not in self._rollups:
+            positions = [DIMENSIONS.index(dimension) for dimension in dimensions]
+            filters = [(DIMENSIONS.index(name), criterion) for name, criterion in criteria.items()]
+            totals = defaultdict(float)
+            for coordinates, amount in self.cells.items():
+                if all(_matches(coordinates[position], criterion) for position, criterion in filters):
+                    totals[tuple(coordinates[position] for position in positions)] += amount
+            self._rollups[cache_key] = dict(totals)
+        return self._rollups[cache_key]
+
+    # This method is used to break one rolled-up cell down by a further dimension
+    def drill_down(self, coordinates, dimension, **criteria):
+        """
+        `coordinates` maps the dimensions of the rolled-up cell to their values,
+        e.g. drill_down({"year": 2024}, "event") gives the 2024 totals per event.
+        """
+        return self.roll_up(*coordinates, dimension, **{**criteria, **coordinates})
+
+    # This method is used to get the grand total of the cells matching the criteria
+    def total(self, **criteria):
+        return self.roll_up(**criteria).get((), 0.0)
+
+    # This method is used to get the largest totals of one dimension
+    def top(self, dimension, n, **criteria):
+        totals = self.roll_up(dimension, **criteria)
+        return heapq.nlargest(n, ((key[0], amount) for key, amount in totals.items()), key=lambda item: item[1])
+
+
+class CubeSlice:
+    """
+    A view of a Cube restricted by criteria; further slices narrow it, and every query
+    is answered (and cached) by the underlying cube.
+    """
+
+    def __init__(self, cube, criteria):
+        self.cube = cube
+        self.criteria = criteria
+
+    def slice(self, **criteria):
+        return CubeSlice(self.cube, {**self.criteria, **criteria})
+
+    def roll_up(self, *dimensions, **criteria):
+        return self.cube.roll_up(*dimensions, **{**self.criteria, **criteria})
+
+    def drill_down(self, coordinates, dimension, **criteria):
+        return self.cube.drill_down(coordinates, dimension, **{**self.criteria, **criteria})
+
+    def total(self, **criteria):
+        return self.cube.total(**{**self.criteria, **criteria})
+
+    def top(self, dimension, n, **criteria):
+        return self.cube.top(dimension, n, **{**self.criteria, **criteria})
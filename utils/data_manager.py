@@ -1,40 +1,503 @@
+import base64
+import functools
+import heapq
 import json
-from datetime import datetime
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+from types import MappingProxyType
+
+import pandas as pd
+
+from utils.aggregates import AggregateIndex
+from utils.anomaly import AnomalyIndex
+from utils.blob_store import BlobStore
+from utils.budget import VarianceEngine
+from utils.cube import Cube
+from utils.date_index import DateIndex
+from utils.date_index import as_date_string
+from utils.forecast import forecast_cash_flow
+from utils.fx import BASE_CURRENCY, conversion_rate, convert_frame, load_rates
+from utils.history import History
+from utils.ledger_codec import PARTITIONED_VERSION, PartitionedSnapshot, decode, snapshot_version
+from utils.recurrence import FREQUENCIES, occurrences, virtual_entry
+from utils.search_index import SearchIndex
+from utils.snapshot import LedgerSnapshot, freeze_costs_year, freeze_entries, transactions_to_frame
+
+# One ledger entry together with where it lives; `key` identifies the entry for incremental indexes
+Transaction = namedtuple("Transaction", ["key", "type", "year", "event", "subcategory", "entry"])
+# Converted frames and cubes kept per ledger version; each may hold up to the whole ledger
+MAX_CONVERSIONS = 8
+
+
+# This function is used to run a DataManager method while holding the instance lock
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# This function is used to summarize an entry for the audit log
+def _describe(entry):
+    return f"{entry.get('date', '')} {entry.get('description', '')} {entry.get('amount', '')}".strip()
+
+
+# This function is used to collect the receipt digests held anywhere inside a ledger section or entry
+def _attachments(value):
+    if isinstance(value, dict):
+        yield from value.get("attachments", ())
+        for item in value.values():
+            yield from _attachments(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _attachments(item)
+
 
 class DataManager:
     # This class is used to manage the data in-memory instead of from a file
-    def __init__(self, data):
+    def __init__(self, data, partitions=None, fx_rates=None, receipts=None):
         """
         Initialize DataManager with the provided in-memory data (from Streamlit secrets).
         The `data` should be a dictionary representing the accounting data.
+        With `partitions` (a PartitionedSnapshot), `data` starts without any year and each
+        year is loaded from its partition the first time it is requested.
+        `fx_rates` is the dated rate table used for currency conversion; by default it is read from fx_rates.csv.
+        `receipts` is the BlobStore holding attached files; entries only keep the files' digests.
         """
         self.data = data
+        # One instance may be shared by several Streamlit sessions, each in its own thread. Writes, undo,
+        # lazy partition loads and cache builds hold this (re-entrant) lock, so two users' writes never
+        # fold into one undo step and readers never walk an index while it is being changed.
+        self.lock = threading.RLock()
+        self._partitions = partitions
+        self._pending_years = set(partitions.partitions) if partitions else set()
         self.subcategories = ["Food", "Supplies", "Clothing", "Transportation", "Rent", "Equipment", "Miscellaneous"]
+        # Bumped on every write; readers can key their caches on it
+        self.version = 0
+        # Frozen per-year tuples shared between snapshots until that year is written to
+        self._frozen = {"revenues": {}, "costs": {}}
+        self._snapshot = None
+        self._forecasts = {}
+        self.fx_rates = load_rates() if fx_rates is None else fx_rates
+        # Conversions to a reporting currency, keyed by (version, currency, ...), least recently used first
+        self._conversions = OrderedDict()
+        self.receipts = receipts or BlobStore()
+        # Reversible deltas of every write, for undo and the audit log
+        self.history = History(lambda: self.version)
+        # Indexes are kept up to date through add/remove calls on every write
+        self.search_index = SearchIndex()
+        self.date_index = DateIndex()
+        self.aggregates = AggregateIndex()
+        self.anomalies = AnomalyIndex()
+        self.cube = Cube()
+        self._indexes = [self.search_index, self.date_index, self.aggregates, self.anomalies, self.cube]
+        # The ledger is walked once and the same Transaction records feed every index
+        self._notify(added=list(self.iter_transactions()))
+
+    # This method is used to build a DataManager straight from a binary ledger snapshot
+    @classmethod
+    def from_snapshot(cls, blob):
+        """
+        Format 2 snapshots are opened lazily: only the partition header is read here.
+        """
+        if snapshot_version(blob) == PARTITIONED_VERSION:
+            partitions = PartitionedSnapshot(blob)
+            data = {"revenues": {}, "costs": {}}
+            data.update(partitions.meta)
+            return cls(data, partitions)
+        return cls(decode(blob))
+
+    # This method is used to build a DataManager from the Streamlit secrets section
+    @classmethod
+    def from_secrets(cls, secret):
+        """
+        Prefer the compact binary snapshot (`snapshot`, base64 text) and fall back to the JSON string (`data`).
+        """
+        if "snapshot" in secret:
+            return cls.from_snapshot(base64.b64decode(secret["snapshot"]))
+        return cls(json.loads(secret["data"]))
+
+    # This method is used to load the partitions of the given years if they are not loaded yet
+    @_locked
+    def _ensure_years(self, years):
+        for year in sorted({str(year) for year in years} & self._pending_years):
+            self._pending_years.discard(year)
+            revenues, costs = self._partitions.load(year)
+            added = []
+            if revenues is not None:
+                self.data.setdefault("revenues", {})[year] = revenues
+                added.extend(self._transaction(entry, year) for entry in revenues)
+                self._touch("revenues", year)
+            if costs is not None:
+                self.data.setdefault("costs", {})[year] = costs
+                added.extend(
+                    self._transaction(entry, year, event, subcategory)
+                    for event, subcategories in costs.items()
+                    for subcategory, entries in subcategories.items()
+                    for entry in entries
+                )
+                self._touch("costs", year)
+            self._notify(added=added)
+
+    # This method is used to load every partition that overlaps a date window
+    def _ensure_window(self, start_date=None, end_date=None):
+        if not self._pending_years:
+            return
+        first = as_date_string(start_date)[:4] if start_date else None
+        last = as_date_string(end_date)[:4] if end_date else None
+        self._ensure_years(
+            year for year in self._pending_years
+            if (first is None or year >= first) and (last is None or year <= last)
+        )
+
+    # This method is used to check whether a year has been closed
+    def is_closed(self, year):
+        return str(year) in self.data.get("closed_years", [])
+
+    # This method is used to close a year so its entries become read-only
+    @_locked
+    def close_year(self, year):
+        if not self.is_closed(year):
+            with self.history.step("close_year", str(year)):
+                self._container(list, "closed_years").append(str(year))
+                self.history.record("close_year", str(year))
+                self._touch("closed_years", year)
+            self.save_data()
+
+    # This method is used to refuse writes to closed years
+    def _check_writable(self, year):
+        if self.is_closed(year):
+            raise ValueError(f"Year {year} is closed and read-only")
+
+    # This method is used to refuse recurring rules that would put occurrences into a closed year
+    def _check_rule_writable(self, rule):
+        first = str(rule["start"])[:4]
+        last = str(rule["end"])[:4] if rule.get("end") else None
+        for year in self.data.get("closed_years", []):
+            if year >= first and (last is None or year <= last):
+                raise ValueError(f"Year {year} is closed and read-only")
+
+    # This method is used to get the revenue and cost totals of a year
+    def get_year_totals(self, year, currency=None):
+        """
+        Return {"수입": revenue total, "지출": cost total} for `year`.
+        A year that is still only in its partition answers from the precomputed partition totals.
+        Occurrences of recurring rules in that year are added on top.
+        With `currency`, the totals are converted to that currency unless every amount is already in it.
+        """
+        year = str(year)
+        if currency is not None and not self._in_currency([year], currency):
+            detail = self._converted_detail(currency)
+            sums = detail[detail['year'] == int(year)].groupby('type')['amount'].sum()
+            totals = {kind: float(sums.get(kind, 0.0)) for kind in ("수입", "지출")}
+            virtual = self._convert_transactions(self._virtual_transactions(f"{year}-01-01", f"{year}-12-31"), currency)
+            for kind, amount in zip(virtual['type'], virtual['amount']):
+                totals[kind] += amount
+            return totals
+        if year in self._pending_years:
+            totals = dict(self._partitions.partitions[year]["totals"])
+        else:
+            totals = {kind: self.aggregates.total(kind, year) for kind in ("수입", "지출")}
+        for transaction in self._virtual_transactions(f"{year}-01-01", f"{year}-12-31"):
+            totals[transaction.type] += float(transaction.entry.get("amount", 0) or 0)
+        return totals
+
+    # This method is used to check whether the given years need no conversion to `currency`
+    def _in_currency(self, years, currency):
+        """
+        Pending years answer from the currencies listed in their partition header; older
+        snapshots without that list are loaded. Recurring rules count for every year.
+        """
+        currencies = {rule.get("currency") or BASE_CURRENCY for rule in self.data.get("recurring", [])}
+        for year in years:
+            partition = self._partitions.partitions[year] if year in self._pending_years else None
+            if partition is not None and "currencies" in partition:
+                currencies.update(partition["currencies"])
+            else:
+                self._ensure_years([year])
+                currencies |= self.aggregates.currencies(year)
+        return currencies <= {currency}
+
+    # This method is used to cache a conversion, dropping older ledger versions and the least recently used entries
+    @_locked
+    def _cached_conversion(self, cache_key, build):
+        """
+        Every date window asked for between two writes is its own entry, so the cache keeps at most
+        MAX_CONVERSIONS of them instead of growing until the next write.
+        """
+        if cache_key in self._conversions:
+            self._conversions.move_to_end(cache_key)
+            return self._conversions[cache_key]
+        for key in [key for key in self._conversions if key[0] != self.version]:
+            del self._conversions[key]
+        value = self._conversions[cache_key] = build()
+        while len(self._conversions) > MAX_CONVERSIONS:
+            self._conversions.popitem(last=False)
+        return value
+
+    # This method is used to convert the aggregate buckets to a reporting currency
+    def _converted_detail(self, currency):
+        """
+        Return the aggregate currency_detail as a DataFrame (type, year, month, event, subcategory, amount)
+        in `currency`. Each monthly bucket is converted at the rate in force on the first of its month,
+        in one vectorized as-of join, and the result is cached per (ledger version, currency).
+        """
+        def build():
+            self._ensure_years(list(self._pending_years))
+            detail = self.aggregates.currency_detail
+            frame = pd.DataFrame(list(detail), columns=['type', 'year', 'month', 'event', 'subcategory', 'currency'])
+            frame['amount'] = list(detail.values())
+            frame['date'] = pd.to_datetime(frame['month'] + '-01', errors='coerce')
+            return convert_frame(frame, currency, self.fx_rates)
+        return self._cached_conversion((self.version, currency), build)
+
+    # This method is used to convert a list of transactions to a reporting currency
+    def _convert_transactions(self, transactions, currency):
+        return convert_frame(transactions_to_frame(transactions), currency, self.fx_rates)
+
+    # This method is used to get the amount cube for reports
+    @_locked
+    def get_cube(self, currency=None, years=None):
+        """
+        Return a Cube over (year, month, event, subcategory, type) covering `years` (default: every year).
+        In the common case (one currency, no recurring rules) this is the incrementally maintained
+        cube itself. Otherwise a copy is built from the converted aggregate buckets plus the recurring
+        occurrences up to the end of the current year, cached per (ledger version, currency).
+        """
+        self._ensure_years(years if years is not None else list(self._pending_years))
+        convert = currency is not None and not self._in_currency([str(year) for year in self.get_years()], currency)
+        if not convert and not self.data.get("recurring"):
+            return self.cube
+
+        def build():
+            if convert:
+                detail = self._converted_detail(currency)
+                cells = zip(zip(detail['year'], detail['month'], detail['event'], detail['subcategory'], detail['type']),
+                            detail['amount'])
+            else:
+                cells = self.cube.cells.items()
+            cube = Cube.from_cells(cells)
+            virtual = self._virtual_transactions()
+            if convert:
+                amounts = self._convert_transactions(virtual, currency)['amount']
+            else:
+                amounts = [float(transaction.entry.get("amount", 0) or 0) for transaction in virtual]
+            for transaction, amount in zip(virtual, amounts):
+                coordinates = (transaction.year, transaction.entry["date"][:7], transaction.event, transaction.subcategory, transaction.type)
+                cube.cells[coordinates] += amount
+            return cube
+        return self._cached_conversion((self.version, "cube", currency), build)
+
+    # This method is used to get the transactions of a window as a DataFrame in a reporting currency
+    def get_transaction_frame(self, currency=BASE_CURRENCY, start_date=None, end_date=None, years=None):
+        """
+        Same selection as get_transactions, as the DataFrame of transactions_to_frame with every amount
+        converted to `currency` at the rate in force on its date. Cached per ledger version,
+        currency and window, so reruns without writes skip both the frame build and the conversion.
+        """
+        cache_key = (self.version, currency, start_date, end_date, tuple(sorted(years)) if years is not None else None)
+        return self._cached_conversion(cache_key, lambda: self._convert_transactions(
+            self.get_transactions(start_date, end_date, years), currency
+        ))
+
+    # This method is used to get the amount cube of a date window, agreeing with get_transaction_frame
+    @_locked
+    def get_window_cube(self, currency=None, start_date=None, end_date=None, years=None):
+        """
+        Return a Cube (or a slice of one) holding exactly the transactions of get_transaction_frame.
+        A window of whole months that needs no conversion is a month slice of get_cube. The cube
+        only knows months and converts per month, so a window cutting into a month, or one in
+        another currency, is built from the cached transaction frame instead and its totals match the frame.
+        """
+        start_date, end_date = as_date_string(start_date), as_date_string(end_date)
+        whole_months = (start_date is None or start_date.endswith("-01")) and (
+            end_date is None or date.fromordinal(date.fromisoformat(end_date).toordinal() + 1).day == 1
+        )
+        convert = currency is not None and not self._in_currency([str(year) for year in self.get_years()], currency)
+        if whole_months and not convert:
+            criteria = {'month': slice(start_date and start_date[:7], end_date and end_date[:7])}
+            if years is not None:
+                criteria['year'] = [int(year) for year in years]
+            return self.get_cube(currency, years=years).slice(**criteria)
+
+        def build():
+            frame = self.get_transaction_frame(currency or BASE_CURRENCY, start_date, end_date, years)
+            months = frame['date'].dt.strftime('%Y-%m').fillna('')
+            return Cube.from_cells(zip(
+                zip(frame['year'], months, frame['event'], frame['subcategory'], frame['type']), frame['amount']
+            ))
+        years_key = tuple(sorted(years)) if years is not None else None
+        return self._cached_conversion((self.version, "window cube", currency, start_date, end_date, years_key), build)
+
+    # This method is used to attach an incremental index and load the existing entries into it
+    def register_index(self, index):
+        self._indexes.append(index)
+        self._notify(added=list(self.iter_transactions()), indexes=[index])
+        return index
+
+    # This method is used to wrap a raw entry into a Transaction record
+    @staticmethod
+    def _transaction(entry, year, event=None, subcategory=None):
+        kind = "수입" if event is None else "지출"
+        return Transaction(id(entry), kind, int(year), event, subcategory, MappingProxyType(entry))
+
+    # This method is used to tell every index about added or removed transactions
+    def _notify(self, added=(), removed=(), replaced=(), indexes=None):
+        for index in self._indexes if indexes is None else indexes:
+            for transaction in removed:
+                index.remove(transaction)
+            # (old, new) pairs of an entry swapped for an updated copy; indexes that track
+            # per-entry state (like anomaly flags) can carry it over instead of starting afresh
+            for old, new in replaced:
+                if hasattr(index, "replace"):
+                    index.replace(old, new)
+                else:
+                    index.remove(old)
+                    index.add(new)
+            # Indexes that can take a batch (like the sorted date index) get it in one call
+            if len(added) > 1 and hasattr(index, "add_many"):
+                index.add_many(added)
+            else:
+                for transaction in added:
+                    index.add(transaction)
+
+    # This method is used to walk every revenue and cost as Transaction records
+    def iter_transactions(self):
+        for year, entries in self.data.get("revenues", {}).items():
+            for entry in entries:
+                yield self._transaction(entry, year)
+        for year, events in self.data.get("costs", {}).items():
+            for event, subcategories in events.items():
+                for subcategory, entries in subcategories.items():
+                    for entry in entries:
+                        yield self._transaction(entry, year, event, subcategory)
+
+    # This method is used to search transaction descriptions
+    @_locked
+    def search_transactions(self, query, **filters):
+        """
+        Ranked full-text search over revenue and cost descriptions.
+        Accepts the filters of SearchIndex.search (min_amount, max_amount, start_date, end_date, limit).
+        Partitions overlapping the date filters are loaded first. The matching window of the date
+        index is passed along, so narrow windows and common terms are answered without scoring every posting.
+        """
+        self._ensure_window(filters.get("start_date"), filters.get("end_date"))
+        filters["candidates"] = self.date_index.window(filters.get("start_date"), filters.get("end_date"))
+        return self.search_index.search(query, **filters)
+
+    # This method is used to get the transactions within a date window
+    @_locked
+    def get_transactions(self, start_date=None, end_date=None, years=None):
+        """
+        Return the transactions dated within [start_date, end_date] in date order.
+        The window is cut out of the date index with binary search; `years` optionally
+        keeps only transactions booked under those years.
+        Only the partitions of the requested years (or of the window) are loaded.
+        Occurrences of recurring rules are expanded for the window and merged in by date.
+        """
+        if years is not None:
+            self._ensure_years(years)
+        else:
+            self._ensure_window(start_date, end_date)
+        transactions = self.date_index.window(start_date, end_date)
+        virtual = self._virtual_transactions(start_date, end_date)
+        if virtual:
+            transactions = list(heapq.merge(transactions, virtual, key=lambda transaction: transaction.entry.get("date") or ""))
+        if years is not None:
+            years = {int(year) for year in years}
+            transactions = [transaction for transaction in transactions if transaction.year in years]
+        return transactions
+
+    # This method is used to list the years present in the ledger
+    def get_years(self):
+        """
+        Years come from the loaded data and the partition metadata, so listing them loads nothing.
+        """
+        years = set(self.data.get("revenues", {})) | set(self.data.get("costs", {})) | self._pending_years
+        return sorted(int(year) for year in years)
+
+    # This method is used to get the earliest and latest transaction dates
+    @_locked
+    def get_date_bounds(self):
+        self._ensure_years(list(self._pending_years))
+        return self.date_index.bounds()
+
+    # This method is used to mark a year as changed so its frozen view is rebuilt on next read
+    def _touch(self, section, year):
+        self.version += 1
+        self._frozen.setdefault(section, {}).pop(str(year), None)
+        self._snapshot = None
+
+    # This method is used to get an immutable, version-stamped snapshot of the in-memory data
+    @_locked
+    def snapshot(self):
+        """
+        Return a LedgerSnapshot of the current data.
+        Years that have not changed since the previous snapshot reuse the same frozen tuples,
+        so taking a snapshot after a single write only re-freezes the year that was written.
+        Only loaded years are part of the snapshot.
+        """
+        if self._snapshot is None or self._snapshot.version != self.version:
+            revenues = {
+                year: self._frozen_year("revenues", year)
+                for year in self.data.get("revenues", {})
+            }
+            costs = {
+                year: self._frozen_year("costs", year)
+                for year in self.data.get("costs", {})
+            }
+            self._snapshot = LedgerSnapshot(self.version, revenues, costs)
+        return self._snapshot
+
+    # This method is used to get (and cache) the frozen form of one year of a section
+    def _frozen_year(self, section, year):
+        frozen = self._frozen[section]
+        if year not in frozen:
+            raw = self.data.get(section, {}).get(year)
+            if section == "revenues":
+                frozen[year] = freeze_entries(raw or [])
+            else:
+                frozen[year] = freeze_costs_year(raw or {})
+        return frozen[year]
 
     # This method is used to get the revenues from the in-memory data
     def get_revenues(self, year=None):
-        revenues = self.data.get("revenues", {})
-        if year:
-            return revenues.get(str(year), [])
-        else:
-            all_revenues = []
-            for year_revenues in revenues.values():
-                all_revenues.extend(year_revenues)
-            return all_revenues
+        """
+        Return a read-only EntryView of the revenues for a year, or of all years.
+        The view chains the per-year tuples of the current snapshot instead of concatenating them.
+        """
+        self._ensure_years([year] if year else list(self._pending_years))
+        return self.snapshot().get_revenues(year)
 
     # This method is used to add a revenue to the in-memory data
+    @_locked
     def add_revenue(self, revenue):
         year = str(datetime.fromisoformat(revenue["date"]).year)
-        if year not in self.data["revenues"]:
-            self.data["revenues"][year] = []
-        self.data["revenues"][year].append(revenue)
+        self._ensure_years([year])
+        self._check_writable(year)
+        with self.history.step("add_revenue", _describe(revenue)):
+            entries = self._container(list, "revenues", year)
+            entries.append(revenue)
+            self.history.record("add_revenue", year, len(entries) - 1)
+            self._notify(added=[self._transaction(revenue, year)])
+            self._touch("revenues", year)
         self.save_data()
 
     # This method is used to remove a revenue from the in-memory data
+    @_locked
     def remove_revenue(self, year, index):
         year_str = str(year)
+        self._ensure_years([year_str])
+        self._check_writable(year_str)
         if year_str in self.data["revenues"] and 0 <= index < len(self.data["revenues"][year_str]):
-            del self.data["revenues"][year_str][index]
+            with self.history.step("remove_revenue", _describe(self.data["revenues"][year_str][index])):
+                removed = self.data["revenues"][year_str].pop(index)
+                self.history.record("remove_revenue", year_str, index, removed)
+                self._notify(removed=[self._transaction(removed, year_str)])
+                self._touch("revenues", year_str)
             self.save_data()
 
     # This method is used to get the costs from the in-memory data
@@ -42,82 +505,523 @@ class DataManager:
         """
         Get costs for a given year or return all costs if no year is specified.
         Safely handle cases where 'costs' or specific years do not exist.
+        The result is a read-only mapping taken from the current snapshot.
         """
-        costs = self.data.get("costs", {})
-        if year:
-            return costs.get(str(year), {})  # Return an empty dict if the year or costs are missing
-        return costs
+        self._ensure_years([year] if year else list(self._pending_years))
+        return self.snapshot().get_costs(year)  # Empty mapping if the year or costs are missing
 
     # This method is used to add a cost event category to the in-memory data
+    @_locked
     def add_event(self, event, year):
         """
         Add a new event to the costs data for the specified year.
         Ensures that the year and event exist in the costs data structure.
         """
         year = str(year)
-        if "costs" not in self.data:
-            self.data["costs"] = {}  # Ensure that 'costs' exists
-
-        if year not in self.data["costs"]:
-            self.data["costs"][year] = {}
-
-        if event not in self.data["costs"][year]:
-            self.data["costs"][year][event] = {subcategory: [] for subcategory in self.subcategories}
+        self._ensure_years([year])
+        self._check_writable(year)
+        if event not in self.data.get("costs", {}).get(year, {}):
+            with self.history.step("add_event", f"{year} {event}"):
+                # Ensure that 'costs' and the year exist
+                self._container(dict, "costs", year)[event] = {subcategory: [] for subcategory in self.subcategories}
+                self.history.record("add_event", year, event)
+                self._touch("costs", year)
 
         self.save_data()
 
     # This method is used to remove a cost event category from the in-memory data
+    @_locked
     def remove_event(self, event, year):
         """
         Remove an event from the costs data for the specified year.
         """
         year = str(year)
+        self._ensure_years([year])
+        self._check_writable(year)
         if "costs" in self.data and year in self.data["costs"] and event in self.data["costs"][year]:
-            del self.data["costs"][year][event]
+            position = list(self.data["costs"][year]).index(event)
+            with self.history.step("remove_event", f"{year} {event} ({self.count_event_costs(event, year)}건)"):
+                removed = self.data["costs"][year].pop(event)
+                # The whole event dict is kept, so undo brings back every cost that went with it
+                self.history.record("remove_event", year, event, position, removed)
+                self._notify(removed=[
+                    self._transaction(entry, year, event, subcategory)
+                    for subcategory, entries in removed.items()
+                    for entry in entries
+                ])
+                self._touch("costs", year)
             self.save_data()
 
+    # This method is used to count the costs recorded under an event, e.g. before removing it
+    def count_event_costs(self, event, year):
+        year = str(year)
+        self._ensure_years([year])
+        return sum(len(entries) for entries in self.data.get("costs", {}).get(year, {}).get(event, {}).values())
+
     # This method is used to add a cost to the in-memory data
+    @_locked
     def add_cost(self, event, subcategory, cost):
         """
         Add a cost under a specific event and subcategory for the specified year.
+        Returns the anomaly flags ("duplicate", "outlier") raised for the new cost, if any.
         """
         year = str(datetime.fromisoformat(cost["date"]).year)
+        self._ensure_years([year])
+        self._check_writable(year)
 
-        # Ensure 'costs' exists
-        if "costs" not in self.data:
-            self.data["costs"] = {}
-
-        # Ensure the year exists in 'costs'
-        if year not in self.data["costs"]:
-            self.data["costs"][year] = {}
+        with self.history.step("add_cost", f"{event}/{subcategory} {_describe(cost)}"):
+            # Ensure the event exists in the specified year (creating 'costs' and the year if needed)
+            if event not in self.data.get("costs", {}).get(year, {}):
+                self.add_event(event, year)
 
-        # Ensure the event exists in the specified year
-        if event not in self.data["costs"][year]:
-            self.add_event(event, year)
+            # Ensure the subcategory exists under the event
+            if subcategory not in self.data["costs"][year][event]:
+                self.data["costs"][year][event][subcategory] = []
+                self.history.record("add_subcategory", year, event, subcategory)
 
-        # Ensure the subcategory exists under the event
-        if subcategory not in self.data["costs"][year][event]:
-            self.data["costs"][year][event][subcategory] = []
-
-        # Add the cost to the specified subcategory
-        self.data["costs"][year][event][subcategory].append(cost)
+            # Add the cost to the specified subcategory
+            entries = self.data["costs"][year][event][subcategory]
+            entries.append(cost)
+            self.history.record("add_cost", year, event, subcategory, len(entries) - 1)
+            self._notify(added=[self._transaction(cost, year, event, subcategory)])
+            self._touch("costs", year)
         self.save_data()
+        return self.anomalies.reasons(id(cost))
 
     # This method is used to remove a cost from the in-memory data
+    @_locked
     def remove_cost(self, year, event, subcategory, index):
         """
         Remove a cost at a given index from a specific event and subcategory.
         """
         year = str(year)
+        self._ensure_years([year])
+        self._check_writable(year)
         if (
             "costs" in self.data and
             year in self.data["costs"] and
             event in self.data["costs"][year] and
             subcategory in self.data["costs"][year][event]
         ):
-            del self.data["costs"][year][event][subcategory][index]
+            entries = self.data["costs"][year][event][subcategory]
+            with self.history.step("remove_cost", f"{event}/{subcategory} {_describe(entries[index])}"):
+                removed = entries.pop(index)
+                self.history.record("remove_cost", year, event, subcategory, index % (len(entries) + 1), removed)
+                self._notify(removed=[self._transaction(removed, year, event, subcategory)])
+                self._touch("costs", year)
+            self.save_data()
+
+    # This method is used to attach a receipt file to a cost
+    @_locked
+    def attach_receipt(self, year, event, subcategory, index, fileobj, name=None, content_type=None):
+        """
+        Stream `fileobj` into the receipt store and add its digest to the cost's `attachments`.
+        The entry is replaced by an updated copy rather than changed in place, so snapshots taken
+        earlier keep seeing the old entry. Returns the digest.
+        """
+        year = str(year)
+        self._ensure_years([year])
+        self._check_writable(year)
+        digest = self.receipts.put(fileobj, name, content_type)
+        entry = self.data["costs"][year][event][subcategory][index]
+        if digest not in entry.get("attachments", []):
+            with self.history.step("attach_receipt", f"{event}/{subcategory} {_describe(entry)} {name or digest[:12]}"):
+                self._replace_cost(year, event, subcategory, index,
+                                   dict(entry, attachments=[*entry.get("attachments", []), digest]))
+            self.save_data()
+        return digest
+
+    # This method is used to remove a receipt from a cost; the stored file is left for prune_receipts
+    @_locked
+    def detach_receipt(self, year, event, subcategory, index, digest):
+        year = str(year)
+        self._ensure_years([year])
+        self._check_writable(year)
+        entry = self.data["costs"][year][event][subcategory][index]
+        if digest in entry.get("attachments", []):
+            with self.history.step("detach_receipt", f"{event}/{subcategory} {_describe(entry)} {digest[:12]}"):
+                attachments = [attached for attached in entry["attachments"] if attached != digest]
+                updated = dict(entry, attachments=attachments)
+                if not attachments:
+                    del updated["attachments"]
+                self._replace_cost(year, event, subcategory, index, updated)
+            self.save_data()
+
+    # This method is used to swap a cost entry for an updated copy
+    def _replace_cost(self, year, event, subcategory, index, entry):
+        entries = self.data["costs"][year][event][subcategory]
+        previous = entries[index]
+        entries[index] = entry
+        self.history.record("replace_cost", year, event, subcategory, index, previous)
+        self._notify(replaced=[(self._transaction(previous, year, event, subcategory),
+                                self._transaction(entry, year, event, subcategory))])
+        self._touch("costs", year)
+
+    # This method is used to delete stored receipts that no entry (or undo step) refers to
+    @_locked
+    def prune_receipts(self):
+        self._ensure_years(list(self._pending_years))
+        referenced = set(_attachments(self.data.get("costs", {})))
+        for _, deltas in self.history.steps():
+            for delta in deltas:
+                referenced.update(_attachments(list(delta.args)))
+        return self.receipts.prune(referenced)
+
+    # This method is used to list the costs flagged as duplicates or outliers
+    @_locked
+    def get_anomalies(self, year=None):
+        self._ensure_years([year] if year else list(self._pending_years))
+        return self.anomalies.flagged(year)
+
+    # This method is used to get the anomaly flags of the costs in one subcategory, by position
+    @_locked
+    def get_cost_flags(self, year, event, subcategory):
+        entries = self.data.get("costs", {}).get(str(year), {}).get(event, {}).get(subcategory, [])
+        return {
+            index: self.anomalies.reasons(id(entry))
+            for index, entry in enumerate(entries)
+            if id(entry) in self.anomalies.flags
+        }
+
+    # This method is used to get the budget allocations stored next to the ledger
+    def get_budgets(self, year=None):
+        """
+        Get budget allocations as {year: {event: {subcategory: amount}}}, or one year of it.
+        """
+        budgets = self.data.get("budgets", {})
+        if year:
+            return MappingProxyType(budgets.get(str(year), {}))
+        return MappingProxyType(budgets)
+
+    # This method is used to set the budget for an event and subcategory in a year
+    @_locked
+    def set_budget(self, year, event, subcategory, amount):
+        year = str(year)
+        with self.history.step("set_budget", f"{year} {event}/{subcategory} {amount}"):
+            event_budgets = self._container(dict, "budgets", year, event)
+            self.history.record("set_budget", year, event, subcategory, event_budgets.get(subcategory))
+            event_budgets[subcategory] = amount
+            self._touch("budgets", year)
+        self.save_data()
+
+    # This method is used to remove a budget allocation
+    @_locked
+    def remove_budget(self, year, event, subcategory):
+        year = str(year)
+        event_budgets = self.data.get("budgets", {}).get(year, {}).get(event)
+        if event_budgets is not None and subcategory in event_budgets:
+            with self.history.step("remove_budget", f"{year} {event}/{subcategory}"):
+                self.history.record("set_budget", year, event, subcategory, event_budgets.pop(subcategory))
+                if not event_budgets:
+                    del self.data["budgets"][year][event]
+                self._touch("budgets", year)
+            self.save_data()
+
+    # This method is used to compare the budget with the actual costs of a year
+    @_locked
+    def get_budget_report(self, year, as_of=None, currency=None):
+        """
+        Return BudgetLine tuples (budget, spent, remaining, burn rate, projected overrun) for `year`.
+        Spent amounts come from the running aggregate totals, so no cost history is rescanned.
+        With `currency`, spent amounts are taken from the converted aggregates when the year holds
+        other currencies, and the budgets (entered in the base currency) are converted at the rate
+        in force on the report date.
+        """
+        self._ensure_years([year])
+        # Recurring costs count as spent once their date has passed
+        as_of_date = as_of or date.today()
+        report_date = min(f"{year}-12-31", as_of_date.isoformat())
+        virtual = [
+            transaction for transaction in self._virtual_transactions(f"{year}-01-01", report_date)
+            if transaction.type == "지출"
+        ]
+        budgets = self.data.get("budgets", {})
+        if currency is None or self._in_currency([str(year)], currency):
+            cost_totals = self.aggregates.cost_totals
+            amounts = [float(transaction.entry.get("amount", 0) or 0) for transaction in virtual]
+        else:
+            detail = self._converted_detail(currency)
+            costs = detail[(detail['type'] == "지출") & (detail['year'] == int(year))]
+            # A line whose costs have no rate stays blank instead of reading as nothing spent
+            cost_totals = {int(year): costs.groupby(['event', 'subcategory'])['amount'].sum(min_count=1).to_dict()}
+            amounts = self._convert_transactions(virtual, currency)['amount'].tolist() if virtual else []
+        if currency is not None and currency != BASE_CURRENCY:
+            rate = conversion_rate(BASE_CURRENCY, currency, report_date, self.fx_rates)
+            budgets = {str(year): {
+                event: {subcategory: float(amount) * rate for subcategory, amount in subcategories.items()}
+                for event, subcategories in budgets.get(str(year), {}).items()
+            }}
+        recurring_spent = {}
+        for transaction, amount in zip(virtual, amounts):
+            key = (transaction.event, transaction.subcategory)
+            recurring_spent[key] = recurring_spent.get(key, 0.0) + amount
+        return VarianceEngine(cost_totals, budgets, recurring_spent).report(year, as_of)
+
+    # This method is used to project month-end balances for the coming months
+    @_locked
+    def get_forecast(self, months=12, as_of=None, currency=None):
+        """
+        Return the cash-flow forecast DataFrame (month, revenue, cost, net, balance).
+        It is built from the monthly aggregates plus scheduled recurring entries and cached
+        per ledger version, so reruns without writes reuse it.
+        With `currency`, a ledger holding other currencies is forecast from its converted aggregates.
+        The starting balance closes the month of `as_of`; entries dated after it are scheduled into
+        the months they fall in, like recurring occurrences, instead of counting as already booked.
+        """
+        as_of = as_of or date.today()
+        cache_key = (self.version, months, as_of, currency)
+        if cache_key not in self._forecasts:
+            self._ensure_years(list(self._pending_years))
+            horizon_end = date(as_of.year + (as_of.month + months) // 12, (as_of.month + months) % 12 + 1, 1)
+            next_month = date(as_of.year + as_of.month // 12, as_of.month % 12 + 1, 1)
+            past = self._virtual_transactions(None, date.fromordinal(next_month.toordinal() - 1))
+            upcoming = self._virtual_transactions(next_month, horizon_end)
+            if currency is None or self._in_currency([str(year) for year in self.get_years()], currency):
+                monthly_detail = self.aggregates.monthly_detail
+                totals = list(self.aggregates.monthly_totals.items())
+                past = [(transaction.type, float(transaction.entry.get("amount", 0) or 0)) for transaction in past]
+                scheduled = [
+                    (transaction.type, transaction.entry["date"][:7], float(transaction.entry.get("amount", 0) or 0))
+                    for transaction in upcoming
+                ]
+            else:
+                # Revenues have no event/subcategory; blank them so each type stays one series
+                detail = self._converted_detail(currency).fillna({'event': '', 'subcategory': ''})
+                monthly_detail = detail.groupby(['type', 'month', 'event', 'subcategory'])['amount'].sum().to_dict()
+                totals = list(detail.groupby(['type', 'month'])['amount'].sum().items())
+                past = self._convert_transactions(past, currency)
+                past = list(zip(past['type'], past['amount']))
+                upcoming = self._convert_transactions(upcoming, currency)
+                scheduled = list(zip(upcoming['type'], upcoming['date'].dt.strftime('%Y-%m'), upcoming['amount']))
+            # Undated entries have an empty month and count as booked
+            current_month = f"{as_of:%Y-%m}"
+            booked = [(kind, total) for (kind, month), total in totals if month <= current_month]
+            scheduled += [(kind, month, total) for (kind, month), total in totals if month > current_month]
+            start_balance = sum(total if kind == "수입" else -total for kind, total in booked)
+            start_balance += sum(amount if kind == "수입" else -amount for kind, amount in past)
+            # Only the current version is worth keeping
+            self._forecasts = {key: value for key, value in self._forecasts.items() if key[0] == self.version}
+            self._forecasts[cache_key] = forecast_cash_flow(
+                monthly_detail, start_balance, months, as_of, scheduled=scheduled
+            )
+        return self._forecasts[cache_key]
+
+    # This method is used to get the recurring rules
+    def get_recurring(self):
+        return tuple(MappingProxyType(rule) for rule in self.data.get("recurring", []))
+
+    # This method is used to add a recurring revenue or cost rule
+    @_locked
+    def add_recurring(self, rule):
+        """
+        Store a recurrence rule instead of concrete entries. The rule needs `type` ("수입" or "지출"),
+        `description`, `amount`, `frequency` (monthly, weekly or custom), `interval` and `start`,
+        plus `event` and `subcategory` for costs. Returns the id assigned to the rule.
+        """
+        if rule.get("frequency") not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency {rule.get('frequency')!r}")
+        if rule.get("type") == "지출" and not (rule.get("event") and rule.get("subcategory")):
+            raise ValueError("Recurring costs need an event and a subcategory")
+        rule = dict(rule, id=rule.get("id") or uuid.uuid4().hex[:8], skip=list(rule.get("skip", [])))
+        self._check_rule_writable(rule)
+        with self.history.step("add_recurring", f"{rule.get('description', '')} {rule.get('amount')}"):
+            self._container(list, "recurring").append(rule)
+            self.history.record("add_recurring", rule["id"])
+            self._touch("recurring", rule["id"])
+        self.save_data()
+        return rule["id"]
+
+    # This method is used to remove a recurring rule
+    @_locked
+    def remove_recurring(self, rule_id):
+        rules = self.data.get("recurring", [])
+        for position, rule in enumerate(rules):
+            if rule["id"] == rule_id:
+                # Dropping the rule would take its occurrences out of any closed year it covers
+                self._check_rule_writable(rule)
+                with self.history.step("remove_recurring", f"{rule.get('description', '')} {rule.get('amount')}"):
+                    self.data["recurring"] = rules[:position] + rules[position + 1:]
+                    self.history.record("remove_recurring", position, rule)
+                    self._touch("recurring", rule_id)
+                self.save_data()
+                return
+
+    # This method is used to find a recurring rule by id
+    def _find_rule(self, rule_id):
+        for rule in self.data.get("recurring", []):
+            if rule["id"] == rule_id:
+                return rule
+        raise KeyError(rule_id)
+
+    # This method is used to drop a single occurrence of a recurring rule
+    @_locked
+    def skip_occurrence(self, rule_id, occurrence):
+        rule = self._find_rule(rule_id)
+        self._check_writable(occurrence[:4])
+        if occurrence not in rule["skip"]:
+            with self.history.step("skip_occurrence", f"{rule.get('description', '')} {occurrence}"):
+                rule["skip"].append(occurrence)
+                self.history.record("skip_occurrence", rule_id, occurrence)
+                self._touch("recurring", rule_id)
             self.save_data()
 
+    # This method is used to turn one occurrence of a recurring rule into a concrete entry
+    @_locked
+    def materialize_occurrence(self, rule_id, occurrence, **changes):
+        """
+        Write the occurrence of `rule_id` on `occurrence` as a regular entry, with `changes` applied
+        (for example a different amount), and stop the rule from producing it virtually.
+        """
+        rule = self._find_rule(rule_id)
+        entry = virtual_entry(rule, occurrence)
+        entry.update(changes)
+        # One undo step puts the occurrence back to virtual
+        with self.history.step("materialize_occurrence", f"{rule.get('description', '')} {occurrence}"):
+            if rule.get("type") == "지출":
+                self.add_cost(rule["event"], rule["subcategory"], entry)
+            else:
+                self.add_revenue(entry)
+            self.skip_occurrence(rule_id, occurrence)
+
+    # This method is used to expand the recurring rules into virtual transactions for a window
+    def _virtual_transactions(self, start_date=None, end_date=None):
+        """
+        Virtual transactions are never stored; an open window ends with the current year.
+        """
+        rules = self.data.get("recurring")
+        if not rules:
+            return []
+        end_date = end_date or f"{date.today().year}-12-31"
+        transactions = []
+        for rule in rules:
+            event = rule.get("event") if rule.get("type") == "지출" else None
+            for occurrence in occurrences(rule, start_date, end_date):
+                transactions.append(Transaction(
+                    (rule["id"], occurrence), rule.get("type", "수입"), int(occurrence[:4]),
+                    event, rule.get("subcategory") if event else None,
+                    MappingProxyType(virtual_entry(rule, occurrence)),
+                ))
+        transactions.sort(key=lambda transaction: transaction.entry["date"])
+        return transactions
+
+    # This method is used to get a container of the ledger, creating any missing level inside the open step
+    def _container(self, factory, *path):
+        """
+        Walk `path` from the top of the data (e.g. "costs", year), creating missing levels as dicts and
+        the last one with `factory`. Every level created is recorded, so undo removes it again.
+        """
+        node = self.data
+        for depth, key in enumerate(path):
+            if key not in node:
+                node[key] = factory() if depth == len(path) - 1 else {}
+                self.history.record("create", *path[:depth + 1])
+            node = node[key]
+        return node
+
+    # This method is used to revert the most recent change
+    @_locked
+    def undo(self):
+        """
+        Apply the inverse of each delta of the latest step, newest first, and return the step's summary.
+        Returns None when there is nothing left to undo.
+        """
+        if not len(self.history):
+            return None
+        summary, deltas = self.history.pop()
+        self.history.replaying = True
+        try:
+            for delta in deltas:
+                getattr(self, f"_undo_{delta.op}")(*delta.args)
+        finally:
+            self.history.replaying = False
+        self.history.log("undo", summary)
+        self.save_data()
+        return summary
+
+    # This method is used to get the audit log, newest record first
+    def get_audit_log(self):
+        return list(reversed(self.history.audit))
+
+    def _undo_create(self, *path):
+        node = self.data
+        for key in path[:-1]:
+            node = node.get(key, {})
+        node.pop(path[-1], None)
+        self._touch(path[0], path[1] if len(path) > 1 else "")
+
+    def _undo_close_year(self, year):
+        self.data["closed_years"].remove(year)
+        self._touch("closed_years", year)
+
+    def _undo_add_revenue(self, year, index):
+        removed = self.data["revenues"][year].pop(index)
+        self._notify(removed=[self._transaction(removed, year)])
+        self._touch("revenues", year)
+
+    def _undo_remove_revenue(self, year, index, entry):
+        self.data.setdefault("revenues", {}).setdefault(year, []).insert(index, entry)
+        self._notify(added=[self._transaction(entry, year)])
+        self._touch("revenues", year)
+
+    def _undo_add_event(self, year, event):
+        self._undo_remove_event(year, event, None, None)
+
+    def _undo_remove_event(self, year, event, position, removed):
+        events = self.data.setdefault("costs", {}).setdefault(year, {})
+        if removed is None:
+            # Undoing add_event: the event was created empty by this step
+            events.pop(event, None)
+        else:
+            # Rebuild the dict to put the event back in its original position
+            items = list(events.items())
+            items.insert(position, (event, removed))
+            self.data["costs"][year] = dict(items)
+            self._notify(added=[
+                self._transaction(entry, year, event, subcategory)
+                for subcategory, entries in removed.items()
+                for entry in entries
+            ])
+        self._touch("costs", year)
+
+    def _undo_add_subcategory(self, year, event, subcategory):
+        self.data["costs"][year][event].pop(subcategory, None)
+        self._touch("costs", year)
+
+    def _undo_add_cost(self, year, event, subcategory, index):
+        removed = self.data["costs"][year][event][subcategory].pop(index)
+        self._notify(removed=[self._transaction(removed, year, event, subcategory)])
+        self._touch("costs", year)
+
+    def _undo_remove_cost(self, year, event, subcategory, index, entry):
+        self.data["costs"][year][event][subcategory].insert(index, entry)
+        self._notify(added=[self._transaction(entry, year, event, subcategory)])
+        self._touch("costs", year)
+
+    def _undo_replace_cost(self, year, event, subcategory, index, previous):
+        self._replace_cost(year, event, subcategory, index, previous)
+
+    def _undo_set_budget(self, year, event, subcategory, previous):
+        event_budgets = self.data.setdefault("budgets", {}).setdefault(year, {}).setdefault(event, {})
+        if previous is None:
+            event_budgets.pop(subcategory, None)
+            if not event_budgets:
+                del self.data["budgets"][year][event]
+        else:
+            event_budgets[subcategory] = previous
+        self._touch("budgets", year)
+
+    def _undo_add_recurring(self, rule_id):
+        self.data["recurring"] = [rule for rule in self.data["recurring"] if rule["id"] != rule_id]
+        self._touch("recurring", rule_id)
+
+    def _undo_remove_recurring(self, position, rule):
+        self.data.setdefault("recurring", []).insert(position, rule)
+        self._touch("recurring", rule["id"])
+
+    def _undo_skip_occurrence(self, rule_id, occurrence):
+        self._find_rule(rule_id)["skip"].remove(occurrence)
+        self._touch("recurring", rule_id)
+
     # Since we are working with in-memory data, there's no file to save
     def save_data(self):
         """
@@ -0,0 +1,73 @@
+from bisect import bisect_left, bisect_right
+
+
+def as_date_string(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else value.isoformat()[:10]
+
+
+class DateIndex:
+    """
+    Transactions kept sorted by date in two parallel lists.
+    Any [start, end] window is found with two binary searches and returned as a slice,
+    so a date range costs O(log n + k) instead of a full scan.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._transactions = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _sort_key(transaction):
+        return (transaction.entry.get("date") or "", transaction.key)
+
+    # This method is used to insert a transaction at its sorted position
+    def add(self, transaction):
+        sort_key = self._sort_key(transaction)
+        position = bisect_right(self._keys, sort_key)
+        self._keys.insert(position, sort_key)
+        self._transactions.insert(position, transaction)
+
+    # This method is used to insert many transactions at once, e.g. when a year is loaded
+    def add_many(self, transactions):
+        """
+        Append and re-sort once instead of inserting one by one, which would shift the lists per entry.
+        """
+        merged = sorted(
+            zip(self._keys + [self._sort_key(transaction) for transaction in transactions],
+                self._transactions + list(transactions)),
+            key=lambda pair: pair[0],
+        )
+        self._keys = [key for key, _ in merged]
+        self._transactions = [transaction for _, transaction in merged]
+
+    # This method is used to drop a transaction from the sorted lists
+    def remove(self, transaction):
+        sort_key = self._sort_key(transaction)
+        position = bisect_left(self._keys, sort_key)
+        if position < len(self._keys) and self._keys[position] == sort_key:
+            del self._keys[position]
+            del self._transactions[position]
+
+    # This method is used to get the earliest and latest dates in the index
+    def bounds(self):
+        if not self._keys:
+            return None, None
+        return self._keys[0][0], self._keys[-1][0]
+
+    # This method is used to get every transaction dated within [start, end]
+    def window(self, start=None, end=None):
+        """
+        Return the transactions dated between `start` and `end` (inclusive) in date order.
+        Either bound may be None for an open range; dates may be ISO strings or date objects.
+        """
+        start = as_date_string(start)
+        end = as_date_string(end)
+        lo = 0 if start is None else bisect_left(self._keys, (start,))
+        # Keys dated `end`, with or without a time part, all sort below end + "\uffff"
+        hi = len(self._keys) if end is None else bisect_right(self._keys, (end + "\uffff",))
+        return self._transactions[lo:hi]
@@ -0,0 +1,94 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+
+def _month_number(month):
+    return int(month[:4]) * 12 + int(month[5:7]) - 1
+
+
+# This function is used to project month-end balances from the monthly aggregates
+def forecast_cash_flow(monthly_detail, start_balance, months=12, as_of=None, alpha=0.3, scheduled=()):
+    """
+    Project revenue, cost and month-end balance for the `months` months after `as_of`.
+
+    `monthly_detail` maps (type, "YYYY-MM", event, subcategory) to an amount, as kept by
+    AggregateIndex. Every (type, event, subcategory) series is handled at once as a row of
+    a NumPy matrix over the complete months of history:
+
+    - seasonal averages per calendar month give each series a seasonal index
+    - simple exponential smoothing of the deseasonalised series gives its current level
+    - the last 12 months against the 12 before them give a year-over-year growth factor
+
+    `scheduled` is an iterable of (type, "YYYY-MM", amount) that is added on top, such as
+    the occurrences of recurring rules. Returns a DataFrame with month, revenue, cost, net
+    and balance columns.
+    """
+    as_of = as_of or date.today()
+    current = as_of.year * 12 + as_of.month - 1
+    horizon = np.arange(current + 1, current + 1 + months)
+
+    series = {}
+    rows, columns, amounts = [], [], []
+    for (kind, month, event, subcategory), amount in monthly_detail.items():
+        if not month or not amount:
+            continue
+        rows.append(series.setdefault((kind, event, subcategory), len(series)))
+        columns.append(_month_number(month))
+        amounts.append(amount)
+    rows, columns, amounts = np.array(rows, dtype=int), np.array(columns, dtype=int), np.array(amounts, dtype=float)
+
+    revenue = np.zeros(months)
+    cost = np.zeros(months)
+    history = columns < current
+    if history.any():
+        first = columns[history].min()
+        span = current - first
+        matrix = np.zeros((len(series), span))
+        np.add.at(matrix, (rows[history], columns[history] - first), amounts[history])
+        month_of_year = np.arange(first, current) % 12
+
+        # Seasonal averages per calendar month; months never seen fall back to the series mean
+        seen = np.bincount(month_of_year, minlength=12)
+        mean = matrix.mean(axis=1, keepdims=True)
+        seasonal = matrix @ np.eye(12)[month_of_year] / np.maximum(seen, 1)
+        seasonal = np.where(seen > 0, seasonal, mean)
+        index = np.divide(seasonal, mean, out=np.ones_like(seasonal), where=mean > 0)
+
+        # Simple exponential smoothing of the deseasonalised series, vectorised over all series
+        factors = index[:, month_of_year]
+        deseasonalised = np.divide(matrix, factors, out=matrix.copy(), where=factors > 0)
+        level = deseasonalised[:, 0]
+        for column in deseasonalised.T[1:]:
+            level = alpha * column + (1 - alpha) * level
+
+        # Year-over-year growth, damped into [0.5, 2] and only when two full years are available
+        growth = np.ones(len(series))
+        if span >= 24:
+            previous = matrix[:, -24:-12].sum(axis=1)
+            recent = matrix[:, -12:].sum(axis=1)
+            growth = np.clip(np.divide(recent, previous, out=np.ones_like(recent), where=previous > 0), 0.5, 2.0)
+
+        steps = np.arange(1, months + 1) / 12
+        projection = level[:, None] * index[:, horizon % 12] * growth[:, None] ** steps
+        is_revenue = np.array([key[0] == '수입' for key in series], dtype=bool)
+        revenue += projection[is_revenue].sum(axis=0)
+        cost += projection[~is_revenue].sum(axis=0)
+
+    for kind, month, amount in scheduled:
+        position = _month_number(month) - (current + 1)
+        if 0 <= position < months:
+            if kind == '수입':
+                revenue[position] += amount
+            else:
+                cost[position] += amount
+
+    net = revenue - cost
+    return pd.DataFrame({
+        'month': pd.to_datetime([f"{number // 12}-{number % 12 + 1:02d}-01" for number in horizon]) + pd.offsets.MonthEnd(0),
+        'revenue': revenue,
+        'cost': cost,
+        'net': net,
+        'balance': start_balance + np.cumsum(net),
+    })
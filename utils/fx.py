@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Amounts without a currency code are in the base currency, and every rate is quoted against it
+BASE_CURRENCY = "KRW"
+CURRENCY_SYMBOLS = {"KRW": "₩", "USD": "$", "EUR": "€", "JPY": "¥"}
+# Local rate table: one row per (date, currency) with the base-currency value of one unit
+DEFAULT_RATES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fx_rates.csv")
+
+
+# This function is used to read the dated FX rate table from a CSV file
+def load_rates(path=DEFAULT_RATES_PATH):
+    """
+    Return the rate table (date, currency, rate) sorted by date, as merge_asof needs.
+    A missing file gives an empty table, so only base-currency amounts can be converted.
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame({
+            'date': pd.Series(dtype='datetime64[ns]'),
+            'currency': pd.Series(dtype=object),
+            'rate': pd.Series(dtype=float),
+        })
+    rates = pd.read_csv(path, dtype={'currency': str, 'rate': float})
+    rates['date'] = pd.to_datetime(rates['date'])
+    rates['currency'] = rates['currency'].str.upper()
+    return rates.dropna().sort_values('date', kind='stable').reset_index(drop=True)
+
+
+# This function is used to list the currencies that can be converted with a rate table
+def available_currencies(rates):
+    return sorted({BASE_CURRENCY, *rates['currency'].unique()})
+
+
+# This function is used to format an amount with its currency symbol
+def format_amount(amount, currency=None, decimals=2):
+    # Rows from a DataFrame may hold NaN for entries without a currency code
+    if not isinstance(currency, str) or not currency:
+        currency = BASE_CURRENCY
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    if symbol is None:
+        return f"{amount:,.{decimals}f} {currency}"
+    return f"{symbol}{amount:,.{decimals}f}"
+
+
+# This function is used to look up the rate in force on each row's date
+def _rates_as_of(dates, currencies, rates):
+    """
+    Vectorized as-of join: each (date, currency) pair gets the latest rate dated on or before it,
+    or the earliest known rate when the date precedes the table. The base currency is always 1.
+    """
+    keys = pd.DataFrame({'date': dates, 'currency': currencies, 'row': np.arange(len(dates))})
+    keys = keys.dropna(subset=['date']).sort_values('date', kind='stable')
+    result = np.full(len(dates), np.nan)
+    if not rates.empty and not keys.empty:
+        backward = pd.merge_asof(keys, rates, on='date', by='currency', direction='backward')
+        forward = pd.merge_asof(keys, rates, on='date', by='currency', direction='forward')
+        result[keys['row'].to_numpy()] = backward['rate'].fillna(forward['rate']).to_numpy()
+    result[np.asarray(currencies) == BASE_CURRENCY] = 1.0
+    return result
+
+
+# This function is used to get the rate turning one unit of `currency` into `reporting_currency` on a date
+def conversion_rate(currency, reporting_currency, on, rates):
+    """
+    Uses the same as-of lookup as convert_frame; NaN when either currency has no rate.
+    """
+    dates = pd.to_datetime([on]).to_numpy()
+    source = _rates_as_of(dates, np.array([currency], dtype=object), rates)
+    target = _rates_as_of(dates, np.array([reporting_currency], dtype=object), rates)
+    return float(source[0] / target[0])
+
+
+# This function is used to convert the amount column of a transaction frame to one currency
+def convert_frame(df, reporting_currency, rates):
+    """
+    Return a copy of `df` with `amount` expressed in `reporting_currency`.
+    The original amount and currency are kept in `original_amount` and `original_currency`.
+    Rows whose currency (or the reporting currency) has no rate get a NaN amount.
+    """
+    df = df.copy()
+    currencies = df['currency'].fillna(BASE_CURRENCY).to_numpy(dtype=object)
+    dates = pd.to_datetime(df['date'], errors='coerce').to_numpy()
+    source = _rates_as_of(dates, currencies, rates)
+    target = _rates_as_of(dates, np.full(len(df), reporting_currency, dtype=object), rates)
+    df['original_amount'] = df['amount']
+    df['original_currency'] = currencies
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').to_numpy(dtype=float) * source / target
+    df['currency'] = reporting_currency
+    return df
@@ -0,0 +1,93 @@
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+# One reversible change: `op` names the mutation and `args` holds just enough to invert it
+Delta = namedtuple("Delta", ["op", "args"])
+AuditRecord = namedtuple("AuditRecord", ["sequence", "timestamp", "version", "action", "summary"])
+Checkpoint = namedtuple("Checkpoint", ["sequence", "timestamp", "version"])
+
+
+class History:
+    """
+    Bounded undo stack and audit log of ledger mutations.
+
+    Each user action is a step made of one or more deltas. Deltas keep only what is needed to
+    invert the change (an index for an append, the removed entry for a delete), never a copy
+    of the ledger. Once more than `max_steps` steps are held, the oldest `checkpoint_every`
+    steps are folded into a checkpoint: they can no longer be undone and their deltas are
+    released, so memory stays proportional to the recent changes.
+    """
+
+    def __init__(self, version, max_steps=200, checkpoint_every=50, max_audit=1000):
+        # Callable returning the current ledger version, stamped on audit records and checkpoints
+        self._version = version
+        self.max_steps = max_steps
+        self.checkpoint_every = checkpoint_every
+        self.audit = deque(maxlen=max_audit)
+        self.checkpoints = deque(maxlen=10)
+        self._steps = deque()
+        self._open = None
+        self._depth = 0
+        self._sequence = 0
+        self.replaying = False
+
+    def __len__(self):
+        return len(self._steps)
+
+    # This method is used to group the deltas of one action (including nested calls) into one step
+    @contextmanager
+    def step(self, action, summary):
+        """
+        Open a step for `action`; nested steps fold into the outermost one, which is
+        pushed on the undo stack and written to the audit log when it closes.
+        """
+        if self.replaying:
+            yield
+            return
+        if self._depth == 0:
+            self._open = (summary, [])
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                summary, deltas = self._open
+                self._open = None
+                if deltas:
+                    self._steps.append((f"{action}: {summary}", deltas))
+                    self.log(action, summary)
+                    self._checkpoint_if_needed()
+
+    # This method is used to record one delta in the open step
+    def record(self, op, *args):
+        if self.replaying or self._open is None:
+            return
+        self._open[1].append(Delta(op, args))
+
+    # This method is used to add an entry to the audit log
+    def log(self, action, summary):
+        self._sequence += 1
+        self.audit.append(AuditRecord(self._sequence, datetime.now().isoformat(timespec="seconds"),
+                                      self._version(), action, summary))
+
+    # This method is used to list the (summary, deltas) of the steps that can still be undone
+    def steps(self):
+        return tuple(self._steps)
+
+    # This method is used to take the most recent step off the undo stack
+    def pop(self):
+        """
+        Return (summary, deltas) of the latest step, deltas in the order they must be inverted.
+        """
+        summary, deltas = self._steps.pop()
+        return summary, list(reversed(deltas))
+
+    # This method is used to fold the oldest steps into a checkpoint once the stack is full
+    def _checkpoint_if_needed(self):
+        if len(self._steps) <= self.max_steps:
+            return
+        for _ in range(min(self.checkpoint_every, len(self._steps))):
+            self._steps.popleft()
+        self.checkpoints.append(Checkpoint(self._sequence, datetime.now().isoformat(timespec="seconds"), self._version()))
@@ -0,0 +1,349 @@
+"""
+Compact binary snapshot format for the ledger.
+
+Format 1: MAGIC (4 bytes) | format version (u8) | zlib-compressed body.
+Format 2: MAGIC | version (u8) | header length (u32) | zlib-compressed JSON header | partitions.
+
+The body stores every entry as one row of fixed-width little-endian columns
+(type, year, date, event, subcategory, description, amount, flags, extras).
+All strings live once in a dictionary-encoded string table and columns hold
+u32 indexes into it (index 0 meaning no value). A group table keeps the (year, event, subcategory) layout,
+including empty groups, and any other top-level keys (such as budgets) are kept
+as a JSON string so the JSON shape round-trips exactly.
+
+Format 2 splits the ledger into one independently compressed body per year.
+The header lists each partition's byte range, whether the year is closed,
+its precomputed totals and the currencies they were entered in, so a reader can start from the header alone and
+decompress a year only when it is first needed.
+"""
+import argparse
+import base64
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"CRMD"
+FORMAT_VERSION = 1
+PARTITIONED_VERSION = 2
+# String index 0 is reserved for "no value"
+NONE = 0
+
+REVENUE, COST = 0, 1
+AMOUNT_IS_INT, AMOUNT_MISSING, DATE_MISSING, DESCRIPTION_MISSING = 1, 2, 4, 8
+STANDARD_KEYS = ("date", "description", "amount")
+# Currency of entries without a currency code (kept in step with utils.fx, which needs pandas)
+BASE_CURRENCY = "KRW"
+
+
+class LedgerFormatError(ValueError):
+    """Raised when a snapshot is not in a format this module can read."""
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings = [None]
+        self._index = {None: NONE}
+
+    def add(self, value):
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+
+def _column(typecode, values=()):
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_column(typecode, buffer, offset, count):
+    column = array(typecode)
+    end = offset + column.itemsize * count
+    column.frombytes(buffer[offset:end])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column, end
+
+
+def _split_entry(entry):
+    """
+    Split an entry into its standard fields, flags and the JSON of any other keys.
+    """
+    date = entry.get("date")
+    description = entry.get("description")
+    amount = entry.get("amount")
+    flags = 0
+    if not isinstance(date, str):
+        flags |= DATE_MISSING
+        date = None
+    if not isinstance(description, str):
+        flags |= DESCRIPTION_MISSING
+        description = None
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        flags |= AMOUNT_MISSING
+        amount = 0.0
+    elif isinstance(amount, int):
+        flags |= AMOUNT_IS_INT
+    extras = {
+        key: value for key, value in entry.items()
+        if key not in STANDARD_KEYS
+        or (key == "date" and flags & DATE_MISSING)
+        or (key == "description" and flags & DESCRIPTION_MISSING)
+        or (key == "amount" and flags & AMOUNT_MISSING)
+    }
+    return date, description, float(amount), flags, (json.dumps(extras, ensure_ascii=False) if extras else None)
+
+
+def _iter_groups(data):
+    for year, entries in data.get("revenues", {}).items():
+        yield REVENUE, year, None, None, entries
+    for year, events in data.get("costs", {}).items():
+        for event, subcategories in events.items():
+            for subcategory, entries in subcategories.items():
+                yield COST, year, event, subcategory, entries
+            if not subcategories:
+                yield COST, year, event, None, ()
+        if not events:
+            yield COST, year, None, None, ()
+
+
+# This function is used to encode the revenues and costs of a JSON-shaped ledger into a columnar body
+def _encode_body(data, meta=None):
+    strings = _StringTable()
+    groups = {name: [] for name in ("type", "year", "event", "subcategory", "size")}
+    rows = {name: [] for name in ("date", "description", "amount", "flags", "extras")}
+
+    for kind, year, event, subcategory, entries in _iter_groups(data):
+        groups["type"].append(kind)
+        groups["year"].append(strings.add(str(year)))
+        groups["event"].append(strings.add(event))
+        groups["subcategory"].append(strings.add(subcategory))
+        groups["size"].append(len(entries))
+        for entry in entries:
+            date, description, amount, flags, extras = _split_entry(entry)
+            rows["date"].append(strings.add(date))
+            rows["description"].append(strings.add(description))
+            rows["amount"].append(amount)
+            rows["flags"].append(flags)
+            rows["extras"].append(strings.add(extras))
+
+    meta_index = strings.add(json.dumps(meta, ensure_ascii=False) if meta else None)
+
+    encoded_strings = [value.encode("utf-8") for value in strings.strings[1:]]
+    return b"".join([
+        struct.pack("<IIII", len(encoded_strings), len(groups["type"]), len(rows["amount"]), meta_index),
+        _column("I", [len(value) for value in encoded_strings]),
+        b"".join(encoded_strings),
+        _column("B", groups["type"]),
+        _column("I", groups["year"]),
+        _column("I", groups["event"]),
+        _column("I", groups["subcategory"]),
+        _column("I", groups["size"]),
+        _column("I", rows["date"]),
+        _column("I", rows["description"]),
+        _column("d", rows["amount"]),
+        _column("B", rows["flags"]),
+        _column("I", rows["extras"]),
+    ])
+
+
+# This function is used to decode a columnar body back into revenues, costs and the meta keys
+def _decode_body(body):
+    string_count, group_count, row_count, meta_index = struct.unpack_from("<IIII", body, 0)
+    offset = 16
+    lengths, offset = _read_column("I", body, offset, string_count)
+    strings = [None]
+    for length in lengths:
+        strings.append(body[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    group_types, offset = _read_column("B", body, offset, group_count)
+    group_years, offset = _read_column("I", body, offset, group_count)
+    group_events, offset = _read_column("I", body, offset, group_count)
+    group_subcategories, offset = _read_column("I", body, offset, group_count)
+    group_sizes, offset = _read_column("I", body, offset, group_count)
+    dates, offset = _read_column("I", body, offset, row_count)
+    descriptions, offset = _read_column("I", body, offset, row_count)
+    amounts, offset = _read_column("d", body, offset, row_count)
+    flags, offset = _read_column("B", body, offset, row_count)
+    extras, offset = _read_column("I", body, offset, row_count)
+
+    # Build every entry in one pass over the columns, then patch the few rows that need it
+    entries = [
+        {"date": strings[date], "description": strings[description], "amount": amount}
+        for date, description, amount in zip(dates, descriptions, amounts)
+    ]
+    for row, (flag, extra) in enumerate(zip(flags, extras)):
+        if not (flag or extra):
+            continue
+        entry = entries[row]
+        if flag & DATE_MISSING:
+            del entry["date"]
+        if flag & DESCRIPTION_MISSING:
+            del entry["description"]
+        if flag & AMOUNT_MISSING:
+            del entry["amount"]
+        elif flag & AMOUNT_IS_INT:
+            entry["amount"] = int(entry["amount"])
+        if extra:
+            entry.update(json.loads(strings[extra]))
+
+    data = {"revenues": {}, "costs": {}}
+    start = 0
+    for group in range(group_count):
+        size = group_sizes[group]
+        group_entries = entries[start:start + size]
+        start += size
+        year = strings[group_years[group]]
+        event = strings[group_events[group]]
+        subcategory = strings[group_subcategories[group]]
+        if group_types[group] == REVENUE:
+            data["revenues"].setdefault(year, []).extend(group_entries)
+        elif event is None:
+            data["costs"].setdefault(year, {})
+        elif subcategory is None:
+            data["costs"].setdefault(year, {}).setdefault(event, {})
+        else:
+            data["costs"].setdefault(year, {}).setdefault(event, {}).setdefault(subcategory, []).extend(group_entries)
+
+    meta = json.loads(strings[meta_index]) if meta_index else {}
+    return data, meta
+
+
+# This function is used to encode the JSON-shaped ledger into the binary snapshot
+def encode(data):
+    meta = {key: value for key, value in data.items() if key not in ("revenues", "costs")}
+    return MAGIC + struct.pack("<B", FORMAT_VERSION) + zlib.compress(_encode_body(data, meta), 9)
+
+
+def _total(entries):
+    return float(sum(
+        entry["amount"] for entry in entries
+        if isinstance(entry.get("amount"), (int, float)) and not isinstance(entry.get("amount"), bool)
+    ))
+
+
+# This function is used to encode the ledger as one compressed partition per year
+def encode_partitioned(data):
+    """
+    Encode the ledger in format 2. Years listed in `data["closed_years"]` are flagged as closed,
+    and every partition carries its revenue/cost totals and entry count.
+    """
+    revenues = data.get("revenues", {})
+    costs = data.get("costs", {})
+    closed_years = {str(year) for year in data.get("closed_years", [])}
+    meta = {key: value for key, value in data.items() if key not in ("revenues", "costs")}
+
+    partitions = []
+    bodies = []
+    offset = 0
+    for year in sorted(set(revenues) | set(costs)):
+        part = {
+            "revenues": {year: revenues[year]} if year in revenues else {},
+            "costs": {year: costs[year]} if year in costs else {},
+        }
+        cost_entries = [
+            entry
+            for subcategories in costs.get(year, {}).values()
+            for entries in subcategories.values()
+            for entry in entries
+        ]
+        body = zlib.compress(_encode_body(part), 9)
+        partitions.append({
+            "year": year,
+            "offset": offset,
+            "length": len(body),
+            "closed": year in closed_years,
+            "entries": len(revenues.get(year, [])) + len(cost_entries),
+            "totals": {"수입": _total(revenues.get(year, [])), "지출": _total(cost_entries)},
+            "currencies": sorted({entry.get("currency") or BASE_CURRENCY for entry in revenues.get(year, []) + cost_entries}),
+        })
+        bodies.append(body)
+        offset += len(body)
+
+    header = zlib.compress(json.dumps({"partitions": partitions, "meta": meta}, ensure_ascii=False).encode("utf-8"), 9)
+    return MAGIC + struct.pack("<BI", PARTITIONED_VERSION, len(header)) + header + b"".join(bodies)
+
+
+# This function is used to read the format version of a snapshot
+def snapshot_version(blob):
+    if blob[:4] != MAGIC:
+        raise LedgerFormatError("not a ledger snapshot")
+    version = blob[4]
+    if version not in (FORMAT_VERSION, PARTITIONED_VERSION):
+        raise LedgerFormatError(f"unsupported snapshot format version {version}")
+    return version
+
+
+class PartitionedSnapshot:
+    """
+    Reader for format 2 snapshots. Only the header is decoded on construction;
+    `load(year)` decompresses and decodes a single year's partition.
+    """
+
+    def __init__(self, blob):
+        if snapshot_version(blob) != PARTITIONED_VERSION:
+            raise LedgerFormatError("not a partitioned ledger snapshot")
+        (header_length,) = struct.unpack_from("<I", blob, 5)
+        header = json.loads(zlib.decompress(blob[9:9 + header_length]).decode("utf-8"))
+        self._blob = blob
+        self._base = 9 + header_length
+        self.meta = header["meta"]
+        self.partitions = {partition["year"]: partition for partition in header["partitions"]}
+
+    # This method is used to decode one year into (revenues list, costs dict)
+    def load(self, year):
+        partition = self.partitions[str(year)]
+        start = self._base + partition["offset"]
+        data, _ = _decode_body(zlib.decompress(self._blob[start:start + partition["length"]]))
+        return data["revenues"].get(partition["year"]), data["costs"].get(partition["year"])
+
+
+# This function is used to decode a binary snapshot back into the JSON-shaped ledger
+def decode(blob):
+    if snapshot_version(blob) == PARTITIONED_VERSION:
+        snapshot = PartitionedSnapshot(blob)
+        data = {"revenues": {}, "costs": {}}
+        for year in snapshot.partitions:
+            revenues, costs = snapshot.load(year)
+            if revenues is not None:
+                data["revenues"][year] = revenues
+            if costs is not None:
+                data["costs"][year] = costs
+        data.update(snapshot.meta)
+        return data
+    data, meta = _decode_body(zlib.decompress(blob[5:]))
+    data.update(meta)
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the ledger between JSON and the binary snapshot format.")
+    parser.add_argument("command", choices=["encode", "decode"])
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--base64", action="store_true", help="read/write the snapshot as base64 text")
+    parser.add_argument("--partitioned", action="store_true", help="encode one lazily loadable partition per year")
+    args = parser.parse_args(argv)
+
+    if args.command == "encode":
+        with open(args.source, encoding="utf-8") as f:
+            data = json.load(f)
+        blob = encode_partitioned(data) if args.partitioned else encode(data)
+        with open(args.target, "wb") as f:
+            f.write(base64.b64encode(blob) if args.base64 else blob)
+    else:
+        with open(args.source, "rb") as f:
+            blob = f.read()
+        data = decode(base64.b64decode(blob) if args.base64 else blob)
+        with open(args.target, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
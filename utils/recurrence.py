@@ -0,0 +1,73 @@
+import calendar
+from datetime import date, timedelta
+
+FREQUENCIES = ("monthly", "weekly", "custom")
+FREQUENCY_LABELS = {"monthly": "매월", "weekly": "매주", "custom": "일 간격"}
+
+
+def _parse(value):
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _add_months(start, months):
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    # Keep the rule's day of month, clamped to the length of shorter months
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+# This function is used to list the dates a recurrence rule falls on within a window
+def occurrences(rule, start=None, end=None):
+    """
+    Yield the ISO dates on which `rule` occurs between `start` and `end` (inclusive).
+
+    A rule is a dict with `frequency` ("monthly", "weekly" or "custom"), `interval`
+    (months, weeks or days between occurrences), `start` and an optional `end`.
+    Dates listed in `skip` (deleted or materialized occurrences) are left out.
+    The first occurrence in the window is computed directly, so a window far from
+    the rule's start date does not walk through the earlier occurrences.
+    """
+    rule_start = _parse(rule["start"])
+    first = max(rule_start, _parse(start) or rule_start)
+    ends = [d for d in (_parse(rule.get("end")), _parse(end)) if d is not None]
+    if not ends:
+        raise ValueError("an end date is needed to expand an open-ended rule")
+    last = min(ends)
+    interval = max(int(rule.get("interval", 1)), 1)
+    skip = set(rule.get("skip", ()))
+    frequency = rule.get("frequency", "monthly")
+
+    if frequency == "monthly":
+        step = (first.year - rule_start.year) * 12 + first.month - rule_start.month
+        step = max(step - step % interval, 0)
+        current = _add_months(rule_start, step)
+        while current <= last:
+            if current >= first and current.isoformat() not in skip:
+                yield current.isoformat()
+            step += interval
+            current = _add_months(rule_start, step)
+    elif frequency in ("weekly", "custom"):
+        days = interval * 7 if frequency == "weekly" else interval
+        offset = (first - rule_start).days
+        current = rule_start + timedelta(days=-(-offset // days) * days)
+        while current <= last:
+            if current.isoformat() not in skip:
+                yield current.isoformat()
+            current += timedelta(days=days)
+    else:
+        raise ValueError(f"unknown frequency {frequency!r}")
+
+
+# This function is used to build the entry a rule produces on a given date
+def virtual_entry(rule, occurrence):
+    entry = {
+        "date": occurrence,
+        "description": rule.get("description", ""),
+        "amount": rule.get("amount", 0),
+        "recurring": rule["id"],
+    }
+    if rule.get("currency"):
+        entry["currency"] = rule["currency"]
+    return entry
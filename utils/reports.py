@@ -0,0 +1,30 @@
+# This function is used to compare revenue, cost and balance across any number of years
+def yearly_comparison(df, years):
+    """
+    Return a DataFrame indexed by year with 수입 (revenue), 지출 (cost) and 잔액 (balance) columns.
+    All years come out of a single groupby over the rows, so the cost does not grow with the number of years.
+    """
+    totals = df.groupby(['year', 'type'])['amount'].sum().unstack(fill_value=0)
+    totals = totals.reindex(index=list(years), columns=['수입', '지출'], fill_value=0)
+    totals['잔액'] = totals['수입'] - totals['지출']
+    totals.index.name = 'year'
+    return totals
+
+
+# This function is used to total the costs per year, event and subcategory
+def cost_breakdown(df):
+    """
+    Return the cost rows of `df` summed per (year, event, subcategory), as the treemap and statements use them.
+    """
+    costs = df[df['type'] == '지출']
+    return costs.groupby(['year', 'event', 'subcategory'])['amount'].sum().reset_index()
+
+
+# This function is used to build the statement of one event
+def event_statement(df, event):
+    """
+    Return (entries, totals) for `event`: its cost rows in date order and its totals per subcategory.
+    """
+    entries = df[(df['type'] == '지출') & (df['event'] == event)].sort_values('date', kind='stable')
+    totals = entries.groupby('subcategory')['amount'].sum().sort_values(ascending=False)
+    return entries, totals
@@ -0,0 +1,162 @@
+import heapq
+import math
+import unicodedata
+from collections import Counter, namedtuple
+
+from utils.date_index import as_date_string
+
+SearchHit = namedtuple("SearchHit", ["score", "transaction"])
+
+
+def ngrams(text, n=2):
+    """
+    Split text into character n-grams per whitespace-separated word.
+    Korean has no reliable word stemming here, so bigrams over syllables give
+    partial and typo-tolerant matches; words shorter than `n` are kept whole.
+    """
+    text = unicodedata.normalize("NFC", str(text or "")).lower()
+    grams = set()
+    for word in text.split():
+        if len(word) <= n:
+            grams.add(word)
+        else:
+            grams.update(word[i:i + n] for i in range(len(word) - n + 1))
+    return grams
+
+
+class SearchIndex:
+    """
+    Inverted index from description n-grams to ledger transactions.
+    It is kept up to date by DataManager through `add` and `remove`, so nothing is rebuilt on search.
+    """
+
+    def __init__(self, n=2):
+        self.n = n
+        self._postings = {}
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    # This method is used to index a single transaction
+    def add(self, transaction):
+        grams = ngrams(transaction.entry.get("description"), self.n)
+        self._docs[transaction.key] = (transaction, grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(transaction.key)
+
+    # This method is used to drop a single transaction from the index
+    def remove(self, transaction):
+        doc = self._docs.pop(transaction.key, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(transaction.key)
+                if not keys:
+                    del self._postings[gram]
+
+    # This method is used to run a ranked search over the indexed descriptions
+    def search(self, query, min_amount=None, max_amount=None, start_date=None, end_date=None,
+               min_similarity=0.5, limit=100, candidates=None):
+        """
+        Return up to `limit` SearchHit tuples ordered by score, then by most recent date.
+
+        The score is the idf-weighted share of query n-grams found in the description,
+        so a description missing a few n-grams (a typo, a different spacing) still matches
+        as long as the share stays above `min_similarity`. An empty query returns every
+        transaction that passes the amount and date filters.
+
+        `candidates` optionally holds the transactions that pass the date filters in date order
+        (a window of the date index). It lets a narrow window be scored directly instead of walking
+        the postings, and lets the best hits of a common query be taken newest first: every
+        description holding all query n-grams scores the maximum 1.0, so the first `limit` such
+        matches walking back from the newest date are the answer.
+        """
+        start_date = as_date_string(start_date)
+        end_date = as_date_string(end_date)
+
+        def accepted(transaction):
+            amount = transaction.entry.get("amount", 0)
+            date = transaction.entry.get("date", "")
+            if min_amount is not None and amount < min_amount:
+                return False
+            if max_amount is not None and amount > max_amount:
+                return False
+            if start_date is not None and date < start_date:
+                return False
+            if end_date is not None and date > end_date:
+                return False
+            return True
+
+        def ranked(hits):
+            order = lambda hit: (hit.score, hit.transaction.entry.get("date", ""))
+            if limit:
+                # Only the best `limit` hits are ordered, not every match
+                return heapq.nlargest(limit, hits, key=order)
+            return sorted(hits, key=order, reverse=True)
+
+        def newest(pool, matches=None):
+            # `pool` is in date order, so the newest `limit` full-score hits end the walk early
+            hits = []
+            for transaction in reversed(pool):
+                if (matches is None or transaction.key in matches) and accepted(transaction):
+                    hits.append(SearchHit(1.0, transaction))
+                    if len(hits) == limit:
+                        break
+            return hits
+
+        query_grams = ngrams(query, self.n)
+        if not query_grams:
+            if candidates is not None and limit:
+                return newest(candidates)
+            pool = candidates if candidates is not None else (transaction for transaction, _ in self._docs.values())
+            return ranked(SearchHit(1.0, transaction) for transaction in pool if accepted(transaction))
+
+        total = len(self._docs) + 1
+        # n-grams the index has never seen carry no information, so they get the minimum weight
+        weights = {
+            gram: math.log(total / (len(self._postings[gram]) + 1)) + 1.0 if gram in self._postings else 1.0
+            for gram in query_grams
+        }
+        query_weight = sum(weights.values())
+        postings = [self._postings.get(gram, ()) for gram in query_grams]
+
+        if candidates is not None and len(candidates) < sum(len(keys) for keys in postings):
+            hits = []
+            for transaction in candidates:
+                doc = self._docs.get(transaction.key)
+                if doc is None:
+                    continue
+                score = sum(weights[gram] for gram in query_grams & doc[1]) / query_weight
+                if score >= min_similarity and accepted(transaction):
+                    hits.append(SearchHit(round(score, 4), transaction))
+            return ranked(hits)
+
+        # Descriptions holding every query n-gram score 1.0, the maximum; when enough of them pass
+        # the filters, the rest of the postings cannot reach the top and are not scored at all
+        if limit and all(postings):
+            matches = set.intersection(*postings) if len(postings) > 1 else postings[0]
+            if candidates is not None and len(matches) * len(matches) > len(candidates) * limit:
+                # Dense matches: walking back through the dates meets `limit` of them quickly
+                full = newest(candidates, matches)
+            else:
+                full = [SearchHit(1.0, self._docs[key][0]) for key in matches if accepted(self._docs[key][0])]
+            if len(full) >= limit:
+                return ranked(full)
+
+        scores = Counter()
+        for gram, keys in zip(query_grams, postings):
+            weight = weights[gram]
+            for key in keys:
+                scores[key] += weight
+        hits = []
+        for key, weight in scores.items():
+            score = weight / query_weight
+            if score < min_similarity:
+                continue
+            transaction = self._docs[key][0]
+            if accepted(transaction):
+                hits.append(SearchHit(round(score, 4), transaction))
+        return ranked(hits)
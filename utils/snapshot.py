@@ -0,0 +1,132 @@
+from bisect import bisect_right
+from collections.abc import Sequence
+from itertools import accumulate, chain
+from types import MappingProxyType
+
+import pandas as pd
+
+from utils.fx import BASE_CURRENCY
+
+
+def freeze_entries(entries):
+    """
+    Wrap a list of entry dicts into a tuple of read-only mapping proxies.
+    The proxies share the underlying dicts, so no entry data is copied.
+    """
+    return tuple(MappingProxyType(entry) for entry in entries)
+
+
+def freeze_costs_year(year_costs):
+    """
+    Freeze one year of the nested costs structure into read-only mappings.
+    """
+    return MappingProxyType({
+        event: MappingProxyType({
+            subcategory: freeze_entries(entries)
+            for subcategory, entries in subcategories.items()
+        })
+        for event, subcategories in year_costs.items()
+    })
+
+
+class EntryView(Sequence):
+    """
+    Read-only, version-stamped view over one or more tuples of entries.
+    The tuples are shared with the DataManager (structural sharing), so
+    building a view over every year never concatenates the entries.
+    """
+
+    __slots__ = ("_chunks", "_offsets", "version")
+
+    def __init__(self, chunks, version):
+        self._chunks = tuple(chunk for chunk in chunks if chunk)
+        self._offsets = tuple(accumulate(len(chunk) for chunk in self._chunks))
+        self.version = version
+
+    def __len__(self):
+        return self._offsets[-1] if self._offsets else 0
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("entry index out of range")
+        chunk = bisect_right(self._offsets, index)
+        start = self._offsets[chunk - 1] if chunk else 0
+        return self._chunks[chunk][index - start]
+
+    def __repr__(self):
+        return f"EntryView(version={self.version}, entries={len(self)})"
+
+    # This method is used to build a DataFrame column by column instead of row by row
+    def to_frame(self, columns=("date", "description", "amount")):
+        """
+        Build a DataFrame from the view without copying each entry into a new dict.
+        Missing keys become None.
+        """
+        return pd.DataFrame({column: [entry.get(column) for entry in self] for column in columns})
+
+
+class LedgerSnapshot:
+    """
+    Immutable picture of the ledger at a given version.
+    `revenues` maps year -> tuple of entries and `costs` maps year -> event -> subcategory -> tuple.
+    Both are read-only mappings whose unchanged years are shared between snapshots.
+    """
+
+    __slots__ = ("version", "revenues", "costs")
+
+    def __init__(self, version, revenues, costs):
+        self.version = version
+        self.revenues = MappingProxyType(dict(revenues))
+        self.costs = MappingProxyType(dict(costs))
+
+    def __repr__(self):
+        return f"LedgerSnapshot(version={self.version}, years={sorted(set(self.revenues) | set(self.costs))})"
+
+    # This method is used to get a view of the revenues for one year or all years
+    def get_revenues(self, year=None):
+        if year:
+            return EntryView([self.revenues.get(str(year), ())], self.version)
+        return EntryView(self.revenues.values(), self.version)
+
+    # This method is used to get the costs for one year or all years
+    def get_costs(self, year=None):
+        if year:
+            return self.costs.get(str(year), MappingProxyType({}))
+        return self.costs
+
+    # This method is used to get a flat view of every cost entry
+    def iter_costs(self, year=None):
+        """
+        Yield (year, event, subcategory, entry) tuples for the costs of one year or all years.
+        """
+        years = [str(year)] if year else list(self.costs)
+        for year_key in years:
+            for event, subcategories in self.costs.get(year_key, {}).items():
+                for subcategory, entries in subcategories.items():
+                    for entry in entries:
+                        yield year_key, event, subcategory, entry
+
+
+# This function is used to turn Transaction records into the frame layout used by the report pages
+def transactions_to_frame(transactions):
+    """
+    Build the combined revenue/cost DataFrame (date, year, type, event, subcategory, description, amount, currency)
+    straight from Transaction records, keeping their order.
+    """
+    return pd.DataFrame({
+        'date': pd.to_datetime([transaction.entry.get('date') for transaction in transactions], errors='coerce'),
+        'year': [transaction.year for transaction in transactions],
+        'type': [transaction.type for transaction in transactions],
+        'event': [transaction.event for transaction in transactions],
+        'subcategory': [transaction.subcategory for transaction in transactions],
+        'description': [transaction.entry.get('description') for transaction in transactions],
+        'amount': [transaction.entry.get('amount', 0) for transaction in transactions],
+        'currency': [transaction.entry.get('currency') or BASE_CURRENCY for transaction in transactions],
+    })
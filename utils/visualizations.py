@@ -2,7 +2,37 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
-def create_monthly_summary_chart(df):
+from utils.fx import BASE_CURRENCY, CURRENCY_SYMBOLS
+
+# Line charts with more points than this are drawn with WebGL (Scattergl) instead of SVG
+WEBGL_THRESHOLD = 5000
+
+# This function is used to pick SVG or WebGL rendering from the number of points a chart draws
+def render_mode(points, threshold=None):
+    threshold = WEBGL_THRESHOLD if threshold is None else threshold
+    return 'webgl' if points > threshold else 'svg'
+
+# This function is used to label an amount axis with the reporting currency
+def amount_axis_title(currency=BASE_CURRENCY, label='Amount'):
+    return f"{label} ({CURRENCY_SYMBOLS.get(currency, currency)})"
+
+# This function is used to give every year a stable colour, however many years are compared
+def year_color_map(years):
+    palette = px.colors.qualitative.Plotly
+    return {str(year): palette[i % len(palette)] for i, year in enumerate(sorted(years))}
+
+# This function is used to draw the cost breakdown (from reports.cost_breakdown) as a treemap
+def create_cost_treemap(df_cost_breakdown, currency=BASE_CURRENCY):
+    fig = px.treemap(df_cost_breakdown, path=['year', 'event', 'subcategory'], values='amount',
+                     title='지출 분석: 연도, 이벤트, 하위 카테고리별', color='amount',
+                     color_continuous_scale='RdYlBu_r', hover_data=['amount'])
+    symbol = CURRENCY_SYMBOLS.get(currency, currency + ' ')
+    fig.update_traces(textinfo='label+value',
+                      hovertemplate=f'<b>%{{label}}</b><br>금액: {symbol}%{{value:,.0f}}')
+    fig.update_layout(height=600, coloraxis_colorbar=dict(title='금액'))
+    return fig
+
+def create_monthly_summary_chart(df, currency=BASE_CURRENCY):
     df['year_month'] = df['date'].dt.to_period('M')
     monthly_summary = df.groupby(['year_month','year','type'])['amount'].sum().unstack(fill_value=0).reset_index()
     monthly_summary['year_month'] = monthly_summary['year_month'].dt.to_timestamp()
@@ -44,7 +74,7 @@ def create_monthly_summary_chart(df):
     fig.update_layout(
         title='Monthly Financial Summary',
         xaxis_title='Month',
-        yaxis_title='Amount ($)',
+        yaxis_title=amount_axis_title(currency),
         barmode='group',
         legend=dict(x=0, y=1.1, orientation='h'),
         margin=dict(l=50,r=50,t=80,b=50),
@@ -55,35 +85,60 @@ def create_monthly_summary_chart(df):
     return fig
 
 ## Revenue Trend is not needed hence not created
-def create_revenue_trend_chart(df_revenue):
-    fig = px.line(df_revenue, x='date', y='amount', color='year', title='Revenue Trend')
-    fig.update_layout(xaxis_title='Date', yaxis_title='Amount ($)')
+def create_revenue_trend_chart(df_revenue, currency=BASE_CURRENCY, webgl_threshold=None):
+    fig = px.line(df_revenue, x='date', y='amount', color='year', title='Revenue Trend',
+                  render_mode=render_mode(len(df_revenue), webgl_threshold))
+    fig.update_layout(xaxis_title='Date', yaxis_title=amount_axis_title(currency))
     fig.update_xaxes(tickformat='%Y-%m-%d')
     return fig
 
 
-def create_cost_trend_chart(df_costs):
+def create_cost_trend_chart(df_costs, currency=BASE_CURRENCY, webgl_threshold=None):
+    mode = render_mode(len(df_costs), webgl_threshold)
     if 'category' not in df_costs.columns:
-        fig = px.line(df_costs, x='date', y='amount', color='type',line_dash='year',title='Cost Trend')
+        fig = px.line(df_costs, x='date', y='amount', color='type',line_dash='year',title='Cost Trend', render_mode=mode)
     else:
-        fig = px.line(df_costs, x='date', y='amount', color='category',line_dash='year',title='Cost Trend by Category')
+        fig = px.line(df_costs, x='date', y='amount', color='category',line_dash='year',title='Cost Trend by Category', render_mode=mode)
                       
     fig.update_layout(
         xaxis_title='Date',
-        yaxis_title='Amount ($)')
+        yaxis_title=amount_axis_title(currency))
     fig.update_xaxes(tickformat='%Y-%m')
     return fig
     
-def create_cumulative_balance_chart(df):
+def create_cumulative_balance_chart(df, forecast=None, currency=BASE_CURRENCY, webgl_threshold=None):
     df_sorted = df.sort_values('date')
-    df_sorted['cumulative_balance'] = df_sorted.apply(lambda row: row['amount'] if row['type'] == 'Revenue' else -row['amount'], axis=1).cumsum()
+    is_revenue = df_sorted['type'].isin(['Revenue', '수입'])
+    df_sorted['cumulative_balance'] = df_sorted['amount'].where(is_revenue, -df_sorted['amount']).cumsum()
+
+    fig = px.line(df_sorted, x='date', y='cumulative_balance', color='year', title='Cumulative Balance Over Time',
+                  render_mode=render_mode(len(df_sorted), webgl_threshold))
 
-    fig = px.line(df_sorted, x='date', y='cumulative_balance', color='year', title='Cumulative Balance Over Time')
-    fig.update_layout(xaxis_title='Date', yaxis_title='Cumulative Balance ($)')
+    # Overlay the projected month-end balances as a dashed line
+    if forecast is not None and not forecast.empty:
+        fig.add_trace(go.Scatter(
+            x=forecast['month'],
+            y=forecast['balance'],
+            name='Forecast',
+            mode='lines+markers',
+            line=dict(color='gray', dash='dash'),
+        ))
+
+    fig.update_layout(xaxis_title='Date', yaxis_title=amount_axis_title(currency, 'Cumulative Balance'))
     fig.update_xaxes(tickformat='%Y-%m-%d')
     return fig
 
-def create_year_over_year_comparison_chart(df):
+# This function is used to draw the running cost total of every subcategory
+def create_cumulative_subcategory_chart(df_expenses, webgl_threshold=None):
+    df_cumulative = df_expenses.sort_values('date').groupby(['date', 'subcategory'])['amount'].sum().unstack(fill_value=0).cumsum()
+    fig = px.line(df_cumulative, x=df_cumulative.index, y=df_cumulative.columns,
+                  title='Cumulative Expenses by Subcategory',
+                  labels={'value': '누적 금액', 'date': '날짜', 'variable': '하위 카테고리'},
+                  render_mode=render_mode(df_cumulative.size, webgl_threshold))
+    fig.update_layout(legend_title_text='하위 카테고리')
+    return fig
+
+def create_year_over_year_comparison_chart(df, currency=BASE_CURRENCY):
     df['month'] = df['date'].dt.month
     yearly_comparison = df.groupby(['year', 'month', 'type'])['amount'].sum().unstack(fill_value=0).reset_index()
     
@@ -127,7 +182,7 @@ def create_year_over_year_comparison_chart(df):
     fig.update_layout(
         title='Year-over-Year Comparison',
         xaxis_title='Month',
-        yaxis_title='Amount ($)',
+        yaxis_title=amount_axis_title(currency),
         legend=dict(x=0, y=1.1, orientation='h'),
         margin=dict(l=50, r=50, t=80, b=50),
     )